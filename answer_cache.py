@@ -0,0 +1,95 @@
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from metrics import inc
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+NUMERAL = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def numerals(question: str):
+    """The numbers in a question, in order ("question 3 of section 2" -> ["3", "2"])."""
+    return NUMERAL.findall(question)
+
+
+class SemanticAnswerCache:
+    """
+    In-memory answer cache looked up by question embedding.
+
+    A question whose embedding has cosine similarity >= `threshold` with a cached question
+    asked against the same index version, and that has the same numbers in it, gets the
+    cached answer. Embeddings barely tell "question 3" from "question 4" apart. Entries expire after `ttl`
+    seconds; past `max_entries` the least recently used entry is dropped. Entries for other
+    index versions are dropped as soon as a new version is seen.
+    """
+
+    def __init__(self, threshold: float = None, ttl: float = None, max_entries: int = None):
+        self.threshold = ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = ttl or ANSWER_CACHE_TTL
+        self.max_entries = max_entries or ANSWER_CACHE_MAX_ENTRIES
+        self.index_version = None
+        self.vectors = None
+        self.entries = []  # [question, answer, created, last_used], row-aligned with self.vectors
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _reset(self, index_version):
+        self.index_version = index_version
+        self.vectors = None
+        self.entries = []
+
+    def _drop(self, keep):
+        self.vectors = self.vectors[keep] if keep else None
+        self.entries = [self.entries[i] for i in keep]
+
+    def get(self, vector, index_version, question: str):
+        """Returns (cached_question, answer) for a near-duplicate of `question`, or None."""
+        with self._lock:
+            if index_version != self.index_version:
+                self._reset(index_version)
+            now = time.time()
+            live = [i for i, entry in enumerate(self.entries) if now - entry[2] <= self.ttl]
+            if len(live) < len(self.entries):
+                self._drop(live)
+            if self.vectors is None:
+                self.misses += 1
+                inc("cache_misses_total", cache="answer")
+                return None
+            scores = self.vectors @ self._normalize(vector)
+            wanted = numerals(question)
+            best = next((int(i) for i in np.argsort(-scores)
+                         if scores[i] >= self.threshold and numerals(self.entries[i][0]) == wanted), None)
+            if best is None:
+                self.misses += 1
+                inc("cache_misses_total", cache="answer")
+                return None
+            self.hits += 1
+            inc("cache_hits_total", cache="answer")
+            entry = self.entries[best]
+            entry[3] = now
+            return entry[0], entry[1]
+
+    def put(self, vector, index_version, question: str, answer: str):
+        with self._lock:
+            if index_version != self.index_version:
+                self._reset(index_version)
+            now = time.time()
+            row = self._normalize(vector)[None, :]
+            self.vectors = row if self.vectors is None else np.vstack([self.vectors, row])
+            self.entries.append([question, answer, now, now])
+            if len(self.entries) > self.max_entries:
+                oldest = min(range(len(self.entries)), key=lambda i: self.entries[i][3])
+                self._drop([i for i in range(len(self.entries)) if i != oldest])
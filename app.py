@@ -1,44 +1,91 @@
 import streamlit as st
-from PyPDF2 import PdfReader, errors
+from PyPDF2 import errors
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
+import asyncio
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import google.generativeai as genai
-from langchain_community.vectorstores import FAISS
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+from pdf_extract import extract_pages
+from index_store import sync_documents
+from ingest import ingest_pdf, prune_documents
+from index_collections import IndexCache, DEFAULT_COLLECTION, collection_path, list_collections
+from qa import answer_questions
+from retrieval import retrieve, RETRIEVAL_MODE, RETRIEVAL_MODES
+from answer_cache import SemanticAnswerCache
+from embedding_cache import CachedEmbeddings, CACHE_STATS
+from metrics import span, collect_timings, summarize
 
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-def get_pdf_text(pdf_docs):
-    text = ""
-    for pdf in pdf_docs:
-        try:
-            pdf_reader = PdfReader(pdf)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        except errors.PdfReadError:
+def get_pdf_documents(pdf_docs, max_workers=None):
+    documents, failures = extract_pages(pdf_docs, max_workers=max_workers)
+    for pdf, e in failures:
+        if isinstance(e, errors.PdfReadError):
             st.error(f"Error: Could not process file {pdf.name}. It may be corrupted or invalid.")
-        except Exception as e:
+        else:
             st.error(f"Unexpected error while processing {pdf.name}: {e}")
-    return text
+    return [(getattr(pdf, "name", str(pdf)), "".join(pages)) for pdf, pages in documents]
+
+def get_pdf_text(pdf_docs, max_workers=None):
+    return "".join(text for _, text in get_pdf_documents(pdf_docs, max_workers=max_workers))
 
 def get_text_chunks(text):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    chunks = text_splitter.split_text(text)
+    with span("split"):
+        chunks = text_splitter.split_text(text)
     return chunks
 
-def get_vector_store(text_chunks):
+def get_vector_store(documents, prune=False, collection=DEFAULT_COLLECTION):
+    """documents is a list of (name, text_chunks); only new or changed chunks are embedded."""
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-        vector_store.save_local("faiss_index")
+        embeddings = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model="models/embedding-001"))
+        return sync_documents(documents, embeddings, collection_path(collection), prune=prune)
     except Exception as e:
         st.error(f"Error while creating vector store: {e}")
 
+# Streams each upload through pages -> chunks -> embedding batches -> index appends, so memory
+# stays flat however large the PDF is; an interrupted upload of the same file resumes where it stopped
+def ingest_uploads(pdf_docs, prune=False, collection=DEFAULT_COLLECTION):
+    try:
+        embeddings = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model="models/embedding-001"))
+        path = collection_path(collection)
+    except Exception as e:
+        st.error(f"Error while creating vector store: {e}")
+        return None
+    totals = {"documents": 0, "pages": 0, "chunks": 0, "embedded": 0, "deleted": 0}
+    bar = st.progress(0.0)
+    for i, pdf in enumerate(pdf_docs):
+        def progress(pages_done, total_pages, chunks_done):
+            bar.progress((i + pages_done / max(total_pages, 1)) / len(pdf_docs),
+                         text=f"{pdf.name}: page {pages_done}/{total_pages}, {chunks_done} chunks")
+        try:
+            stats = ingest_pdf(pdf, pdf.name, embeddings, path, progress=progress)
+        except errors.PdfReadError:
+            st.error(f"Error: Could not process file {pdf.name}. It may be corrupted or invalid.")
+            continue
+        except Exception as e:
+            st.error(f"Error while indexing {pdf.name}: {e}")
+            continue
+        if stats["resumed_from_page"]:
+            st.info(f"{pdf.name}: resumed from page {stats['resumed_from_page'] + 1}")
+        totals["documents"] += 1
+        for key in ("pages", "chunks", "embedded", "deleted"):
+            totals[key] += stats[key]
+    if prune:
+        try:
+            totals["deleted"] += prune_documents({pdf.name for pdf in pdf_docs}, embeddings, path)
+        except Exception as e:
+            st.error(f"Error while removing documents that were not uploaded: {e}")
+    bar.progress(1.0, text="Done")
+    return totals
+
+# Built once per process and shared by every Streamlit session
+@st.cache_resource
 def get_conversational_chain():
     prompt_template = """
     Answer the question as detailed as possible from the provided context. If the answer is not in
@@ -52,17 +99,64 @@ def get_conversational_chain():
     prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
     return load_qa_chain(model, chain_type="stuff", prompt=prompt)
 
-from langchain_community.vectorstores import FAISS
+# Each collection's index stays in memory across questions and sessions, and reloads in the
+# background when its files change; the least recently used collections are unloaded first
+@st.cache_resource
+def get_index_cache():
+    embeddings = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model="models/embedding-001"))
+    return IndexCache(embeddings)
+
+def build_qa_prompt(chain, docs, question):
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return chain.llm_chain.prompt.format(context=context, question=question)
+
+def stream_answer(chain, docs, question):
+    """Yields the answer text as the model generates it, using the chain's own prompt and model."""
+    with span("llm"):
+        for piece in chain.llm_chain.llm.stream(build_qa_prompt(chain, docs, question)):
+            yield piece.content
+
+def answer_questions_batch(questions, k=4, collection=DEFAULT_COLLECTION):
+    """
+    Answers many questions at once: one batched embedding request, one FAISS search over
+    all of them, and the Gemini calls made concurrently. Returns answers with timings.
+    """
+    chain = get_conversational_chain()
+
+    async def answer_fn(question, docs):
+        response = await chain.llm_chain.llm.ainvoke(build_qa_prompt(chain, docs, question))
+        return response.content
+
+    handle = get_index_cache().get(collection)
+    return asyncio.run(answer_questions(questions, handle.get(), answer_fn, k=k,
+                                        answer_cache=get_answer_cache(collection), index_version=handle.version))
+
+# Answers to near-duplicate questions against the same index version are reused without an LLM call;
+# one cache per collection
+@st.cache_resource
+def get_answer_cache(collection=DEFAULT_COLLECTION):
+    return SemanticAnswerCache()
 
-def user_input(user_question):
+# mode is vector, lexical or hybrid (see retrieval.py); lexical matches skip the embedding call
+# and therefore the semantic answer cache too
+def user_input(user_question, collection=DEFAULT_COLLECTION, mode=None):
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        docs = new_db.similarity_search(user_question)
+        handle = get_index_cache().get(collection)
+        new_db = handle.get()
+        docs, question_vector = retrieve(new_db, user_question, mode=mode)
+
+        if question_vector is not None:
+            cached = get_answer_cache(collection).get(question_vector, handle.version, user_question)
+            if cached is not None:
+                st.write("Reply: ", cached[1])
+                st.caption(f"Answered from cache (similar question: \"{cached[0]}\")")
+                return
 
         chain = get_conversational_chain()
-        response = chain({"input_documents": docs, "question": user_question}, return_only_outputs=True)
-        st.write("Reply: ", response["output_text"])
+        st.write("Reply: ")
+        answer = st.write_stream(stream_answer(chain, docs, user_question))
+        if question_vector is not None:
+            get_answer_cache(collection).put(question_vector, handle.version, user_question, answer)
     except Exception as e:
         st.error(f"Error during question processing: {e}")
 
@@ -71,20 +165,55 @@ def main():
     st.set_page_config("Chat PDF")
     st.header("Chat with PDF💁")
 
+    collections = list_collections()
+    collection = st.sidebar.text_input("Collection", value=DEFAULT_COLLECTION,
+                                       help="Course, exam or session; each collection has its own index. "
+                                            f"Existing: {', '.join(collections) or 'none'}")
+    mode = st.sidebar.selectbox("Retrieval", RETRIEVAL_MODES, index=RETRIEVAL_MODES.index(RETRIEVAL_MODE),
+                                help="lexical and hybrid answer keyword lookups without an embedding call")
     user_question = st.text_input("Ask a Question from the PDF Files")
 
     if user_question:
-        user_input(user_question)
+        user_input(user_question, collection, mode)
+
+    with st.expander("Ask many questions at once"):
+        batch_questions = st.text_area("One question per line")
+        if st.button("Answer all"):
+            questions = [q.strip() for q in batch_questions.splitlines() if q.strip()]
+            if questions:
+                try:
+                    with st.spinner(f"Answering {len(questions)} questions..."):
+                        result = answer_questions_batch(questions, collection=collection)
+                    st.caption(f"Embedding {result['timings']['embed_ms']} ms, "
+                               f"search {result['timings']['search_ms']} ms, "
+                               f"total {result['timings']['total_ms']} ms")
+                    st.dataframe([{"Question": a["question"], "Answer": a["answer"] or a.get("error"),
+                                   "Cached": a.get("cached", False), "LLM ms": a["timings"]["llm_ms"]}
+                                  for a in result["answers"]])
+                except Exception as e:
+                    st.error(f"Error during question processing: {e}")
 
     with st.sidebar:
         st.title("Menu:")
         pdf_docs = st.file_uploader("Upload your PDF Files", accept_multiple_files=True)
+        prune = st.checkbox("Remove documents not in this upload")
         if st.button("Submit & Process"):
-            with st.spinner("Processing..."):
-                raw_text = get_pdf_text(pdf_docs)
-                text_chunks = get_text_chunks(raw_text)
-                get_vector_store(text_chunks)
-                st.success("Done")
+            if pdf_docs:
+                stats = ingest_uploads(pdf_docs, prune=prune, collection=collection)
+                if stats is not None:
+                    st.success(f"Done: {stats['documents']} documents, {stats['pages']} pages, {stats['chunks']} chunks "
+                               f"({stats['embedded']} embedded), {stats['deleted']} removed")
+        st.caption(f"Embedding cache: {CACHE_STATS['hits']} hits, {CACHE_STATS['misses']} misses, "
+                   f"{CACHE_STATS['api_calls']} API calls")
+
+# Optional timing panel: per-stage totals for the last run that did any work
+def show_timings(timings):
+    if timings:
+        st.session_state["last_timings"] = summarize(timings)
+    if st.sidebar.checkbox("Show stage timings") and st.session_state.get("last_timings"):
+        st.sidebar.dataframe(st.session_state["last_timings"])
 
 if __name__ == "__main__":
-    main()
+    with collect_timings() as timings:
+        main()
+    show_timings(timings)
@@ -0,0 +1,118 @@
+"""
+Local stand-ins for the OpenAI-compatible embedding and chat endpoints, for benchmarks.
+
+Responses are deterministic: an embedding is derived from the SHA-256 of its input, and a
+chat completion echoes a fixed structured-extraction JSON document. Each request sleeps
+for `latency` seconds (plus `per_token_latency` per streamed token) to mimic a provider.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+FAKE_ANSWER = json.dumps({
+    "assessment_type": "written_assessment",
+    "duration": 60,
+    "assessment_instruction": ["Answer all questions."],
+    "case_study_context": "",
+    "questions_and_answers": [],
+})
+
+
+def fake_embedding(text, dim: int):
+    seed = int.from_bytes(hashlib.sha256(repr(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeProviderServer:
+    def __init__(self, latency: float = 0.05, per_token_latency: float = 0.0, dim: int = 256, port: int = 0):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.dim = dim
+        self.requests = {"embeddings": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _handler(server):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(server.latency)
+                if self.path.endswith("/embeddings"):
+                    server._count("embeddings")
+                    inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                    self._send_json({
+                        "object": "list",
+                        "model": request.get("model"),
+                        "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, server.dim)}
+                                 for i, text in enumerate(inputs)],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                    })
+                elif self.path.endswith("/chat/completions"):
+                    server._count("chat")
+                    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in request.get("messages", []))
+                    completion_tokens = len(FAKE_ANSWER) // 4
+                    if request.get("stream"):
+                        self._stream(request, completion_tokens)
+                    else:
+                        self._send_json({
+                            "id": "fake", "object": "chat.completion", "created": int(time.time()),
+                            "model": request.get("model"),
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": FAKE_ANSWER}}],
+                            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                      "total_tokens": prompt_tokens + completion_tokens},
+                        })
+                else:
+                    self.send_error(404)
+
+            def _stream(self, request, completion_tokens):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                pieces = [FAKE_ANSWER[i:i + 16] for i in range(0, len(FAKE_ANSWER), 16)]
+                for piece in pieces:
+                    time.sleep(server.per_token_latency * 4)
+                    chunk = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": request.get("model"),
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,169 @@
+"""
+Offline benchmark of the ingest -> chunk -> embed -> index -> query -> extract path.
+
+Runs the real functions from app.py and test.py against synthetic PDFs, with the embedding
+and chat models pointed at a local fake OpenAI-compatible server, and prints one JSON
+document with throughput, query latency percentiles and peak RSS so runs can be compared:
+
+    python -m bench.run_benchmark --docs 2 --pages 300 --queries 50 --latency 0.05 --output run.json
+
+Everything runs in a temporary working directory, so faiss_index/ and .cache/ start cold.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench.fake_servers import FakeProviderServer
+from bench.synthetic_pdf import write_pdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2, help="number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=100, help="pages per PDF")
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=30, help="number of user_input calls to time")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every fake API request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed token")
+    parser.add_argument("--dim", type=int, default=256, help="fake embedding dimension")
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def rate(count, seconds):
+    return round(count / seconds, 2) if seconds > 0 else None
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000
+    return {"count": len(samples), "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2), "p99_ms": round(float(np.percentile(ms, 99)), 2)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"main_process": round(own, 1), "largest_child": round(children, 1)}
+
+
+def load_modules(server):
+    """Imports app.py and test.py configured for the fake server, with the Gemini classes swapped for it."""
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "GOOGLE_API_KEY": "bench",
+        "OPENAI_BASE_URL": server.base_url,
+        "OPENAI_API_BASE": server.base_url,
+        "EMBEDDING_CACHE_PATH": os.path.join(os.getcwd(), ".cache", "embeddings.sqlite"),
+        "EXTRACTION_CACHE_PATH": os.path.join(os.getcwd(), ".cache", "extractions.sqlite"),
+        "OPENAI_REQUESTS_PER_MINUTE": "1000000",
+        "OPENAI_TOKENS_PER_MINUTE": "1000000000",
+    })
+    sys.path.insert(0, REPO_ROOT)
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    app = importlib.import_module("app")
+    service = importlib.import_module("test")
+    # The fake server speaks the OpenAI protocol, so the Gemini models in app.py are replaced
+    # by OpenAI clients that keep the same model names (and therefore the same cache keys).
+    app.GoogleGenerativeAIEmbeddings = lambda model: OpenAIEmbeddings(model=model, check_embedding_ctx_length=False)
+    app.ChatGoogleGenerativeAI = lambda model, temperature: ChatOpenAI(model=model, temperature=temperature)
+    return app, service
+
+
+def run(args):
+    server = FakeProviderServer(latency=args.latency, per_token_latency=args.token_latency, dim=args.dim).start()
+    workdir = tempfile.mkdtemp(prefix="chatwithpdf-bench-")
+    os.chdir(workdir)
+
+    import streamlit as st
+    errors = []
+    st.error = lambda message, *a, **k: errors.append(str(message))
+
+    app, service = load_modules(server)
+    report = {"config": vars(args), "stages": {}}
+    stages = report["stages"]
+
+    paths = []
+    for i in range(args.docs):
+        path = os.path.join(workdir, f"assessment_{i}.pdf")
+        write_pdf(path, args.pages, args.lines_per_page, doc=i)
+        paths.append(path)
+    total_pages = args.docs * args.pages
+
+    started = time.perf_counter()
+    documents = app.get_pdf_documents(paths, max_workers=args.workers)
+    elapsed = time.perf_counter() - started
+    stages["get_pdf_text"] = {"seconds": round(elapsed, 3), "pages": total_pages, "pages_per_sec": rate(total_pages, elapsed)}
+
+    started = time.perf_counter()
+    chunked = [(name, app.get_text_chunks(text)) for name, text in documents]
+    elapsed = time.perf_counter() - started
+    total_chunks = sum(len(chunks) for _, chunks in chunked)
+    stages["get_text_chunks"] = {"seconds": round(elapsed, 3), "chunks": total_chunks,
+                                 "chunks_per_sec": rate(total_chunks, elapsed)}
+
+    started = time.perf_counter()
+    index_stats = app.get_vector_store(chunked)
+    elapsed = time.perf_counter() - started
+    stages["get_vector_store"] = {"seconds": round(elapsed, 3), "chunks": total_chunks,
+                                  "chunks_per_sec": rate(total_chunks, elapsed), "index": index_stats}
+
+    latencies = []
+    for i in range(args.queries):
+        started = time.perf_counter()
+        app.user_input(f"What should the candidate discuss about topic {i} and outcome {i % 13}?")
+        latencies.append(time.perf_counter() - started)
+    stages["user_input"] = percentiles(latencies)
+
+    full_text = "".join(text for _, text in documents)
+    try:
+        extraction_chunks = service.get_question_chunks(full_text)
+        splitter = "question_splitter"
+    except Exception:
+        # The tiktoken vocabulary is downloaded on first use; offline, fall back to the plain splitter.
+        extraction_chunks = service.get_text_chunks(full_text)
+        splitter = "recursive_character"
+    for label in ("extract_structured_data_cold", "extract_structured_data_warm"):
+        started = time.perf_counter()
+        asyncio.run(service.extract_structured_data(extraction_chunks))
+        elapsed = time.perf_counter() - started
+        # The engine's semaphore and limiter belong to the loop that created them.
+        service._extraction_engine = None
+        stages[label] = {"seconds": round(elapsed, 3), "chunks": len(extraction_chunks), "splitter": splitter,
+                         "chunks_per_sec": rate(len(extraction_chunks), elapsed)}
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    report["provider_requests"] = dict(server.requests)
+    report["errors"] = errors
+    server.stop()
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Writes assessment-like PDFs of any size without a PDF library, for benchmarks."""
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(page: int, lines_per_page: int, doc: int = 0):
+    lines = []
+    for i in range(lines_per_page):
+        n = page * lines_per_page + i
+        if n % 12 == 0:
+            lines.append(f"Question {n // 12 + 1} (10 marks) Explain the concept numbered {n} in detail.")
+        elif n % 12 == 4:
+            lines.append("Suggested answer (any 2)")
+        else:
+            lines.append(f"Point {n}.{doc}: the candidate should discuss topic {n % 97} and its impact on outcome {n % 13}.")
+    return lines
+
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 40, doc: int = 0):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        text += [f"({_escape(line)}) Tj T*" for line in page_lines(page, lines_per_page, doc)]
+        text.append("ET")
+        stream = "\n".join(text).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{k} 0 R" for k in kids).encode(), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
@@ -0,0 +1,217 @@
+"""
+On-disk layout of a FAISS index directory, without pickles:
+
+    index.faiss    the FAISS index
+    ids.json       docstore id of every vector, in position order
+    chunks.sqlite  chunk text and metadata by docstore id, read only for the hits of a search,
+                   plus an FTS5 full-text index of the text kept up to date by triggers
+
+Opening an index reads index.faiss and ids.json; chunk text stays on disk, so open time and
+resident memory follow the number of vectors, not the size of the corpus text. Directories
+written by FAISS.save_local (index.pkl) are migrated to this layout the first time they are
+opened.
+
+Chunks an index no longer refers to are kept for CHUNK_PURGE_GRACE_SECONDS, so processes
+still holding an older copy of the index can fetch their hits until they reload it.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_NAME = "index.faiss"
+IDS_NAME = "ids.json"
+CHUNKS_NAME = "chunks.sqlite"
+PICKLE_NAME = "index.pkl"
+CHUNK_PURGE_GRACE_SECONDS = float(os.getenv("CHUNK_PURGE_GRACE_SECONDS", "3600"))
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    page_content, content='chunks', content_rowid='rowid', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, page_content) VALUES (new.rowid, new.page_content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, page_content) VALUES ('delete', old.rowid, old.page_content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE OF page_content ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, page_content) VALUES ('delete', old.rowid, old.page_content);
+    INSERT INTO chunks_fts(rowid, page_content) VALUES (new.rowid, new.page_content);
+END;
+"""
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    A langchain docstore backed by SQLite, shared by the FAISS store and its readers.
+
+    add() writes inside an open transaction that commit() makes visible to other
+    connections and rollback() discards; a writer that fails must call one of them, or
+    close(), to release the write lock. delete() is a no-op: purge() marks the rows the saved index no longer
+    refers to and removes them once they have been unreferenced for the grace period.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # REPLACE must fire the delete trigger too, or the full-text index keeps the old text.
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL, orphaned REAL)"
+        )
+        has_fts = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        self._conn.executescript(FTS_SCHEMA)
+        if not has_fts:
+            # Stores written before the full-text index existed are indexed once.
+            self._conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        self._conn.commit()
+
+    def add(self, texts):
+        rows = [(doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, page_content, metadata) VALUES (?, ?, ?)", rows)
+
+    def delete(self, ids):
+        pass
+
+    def search(self, search: str):
+        with self._lock:
+            row = self._conn.execute("SELECT page_content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def lexical_search(self, terms, k: int = 4, match_all: bool = False):
+        """
+        BM25 full-text search over the chunks still referenced by the index. Returns up to k
+        (Document, score) pairs, best first; a higher score is a better match.
+        """
+        if not terms:
+            return []
+        query = (" AND " if match_all else " OR ").join('"' + term.replace('"', '""') + '"' for term in terms)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunks.id, chunks.page_content, chunks.metadata, bm25(chunks_fts) AS rank"
+                " FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid"
+                " WHERE chunks_fts MATCH ? AND chunks.orphaned IS NULL ORDER BY rank LIMIT ?",
+                (query, k),
+            ).fetchall()
+        return [(Document(id=doc_id, page_content=text, metadata=json.loads(metadata)), -rank)
+                for doc_id, text, metadata, rank in rows]
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+    def close(self):
+        """Closes the connection; anything not committed is rolled back."""
+        with self._lock:
+            self._conn.close()
+
+    def purge(self, keep_ids, grace: float = None) -> int:
+        """
+        Marks rows whose id is not in `keep_ids` as orphaned and deletes those orphaned for
+        more than `grace` seconds; returns how many were deleted.
+        """
+        grace = CHUNK_PURGE_GRACE_SECONDS if grace is None else grace
+        now = time.time()
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (id TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM keep")
+            self._conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((doc_id,) for doc_id in keep_ids))
+            self._conn.execute("UPDATE chunks SET orphaned = NULL"
+                               " WHERE orphaned IS NOT NULL AND id IN (SELECT id FROM keep)")
+            self._conn.execute("UPDATE chunks SET orphaned = ? WHERE orphaned IS NULL AND id NOT IN (SELECT id FROM keep)",
+                               (now,))
+            removed = self._conn.execute("DELETE FROM chunks WHERE orphaned < ?", (now - grace,)).rowcount
+            self._conn.execute("DELETE FROM keep")
+            self._conn.commit()
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def _write_json(target: str, data):
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, target)
+
+
+def _read_ids(path: str):
+    try:
+        with open(os.path.join(path, IDS_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def empty_store(path: str, embeddings, dim: int) -> FAISS:
+    """A new flat store of `dim`-dimensional vectors whose chunks go to `path`/chunks.sqlite."""
+    os.makedirs(path, exist_ok=True)
+    return FAISS(embeddings, faiss.IndexFlatL2(dim), SQLiteDocstore(os.path.join(path, CHUNKS_NAME)), {})
+
+
+def migrate_pickle(path: str) -> bool:
+    """Moves the chunks of a save_local() index.pkl into chunks.sqlite and ids.json; True if there was one."""
+    pickle_path = os.path.join(path, PICKLE_NAME)
+    if not os.path.exists(pickle_path):
+        return False
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    store = SQLiteDocstore(os.path.join(path, CHUNKS_NAME))
+    store.add(docstore._dict)
+    store.commit()
+    _write_json(os.path.join(path, IDS_NAME), [index_to_docstore_id[i] for i in range(len(index_to_docstore_id))])
+    os.remove(pickle_path)
+    return True
+
+
+def load_store(path: str, embeddings) -> FAISS:
+    if not os.path.exists(os.path.join(path, IDS_NAME)):
+        migrate_pickle(path)
+    index = faiss.read_index(os.path.join(path, INDEX_NAME))
+    ids = _read_ids(path)
+    if len(ids) != index.ntotal:
+        raise ValueError(f"{path}: {IDS_NAME} has {len(ids)} ids for {index.ntotal} vectors.")
+    docstore = SQLiteDocstore(os.path.join(path, CHUNKS_NAME))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def save_store(path: str, vector_store: FAISS):
+    """
+    Writes the index and its ids. New chunks are committed before the index that refers to
+    them is replaced, and chunks it no longer refers to are purged after it.
+    """
+    os.makedirs(path, exist_ok=True)
+    docstore = vector_store.docstore
+    if not isinstance(docstore, SQLiteDocstore):
+        docstore = SQLiteDocstore(os.path.join(path, CHUNKS_NAME))
+        docstore.add(vector_store.docstore._dict)
+        vector_store.docstore = docstore
+    docstore.commit()
+
+    ids = [vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal)]
+    tmp = os.path.join(path, INDEX_NAME + ".tmp")
+    faiss.write_index(vector_store.index, tmp)
+    os.replace(tmp, os.path.join(path, INDEX_NAME))
+    _write_json(os.path.join(path, IDS_NAME), ids)
+    if os.path.exists(os.path.join(path, PICKLE_NAME)):
+        os.remove(os.path.join(path, PICKLE_NAME))
+    docstore.purge(ids)
@@ -0,0 +1,140 @@
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import inc, span
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+
+# Process-wide totals across every CachedEmbeddings instance.
+# hits / misses count texts, api_calls counts requests actually sent to the provider.
+CACHE_STATS = Counter()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with an on-disk cache keyed by (model name, SHA-256 of the text).
+    Document and query embeddings are cached separately.
+
+    Misses are sent to the wrapped model in batches of `batch_size`. The cache holds at most
+    `max_entries` vectors; beyond that the least recently used ones are evicted.
+    """
+
+    def __init__(self, embeddings, path: str = None, max_entries: int = None, batch_size: int = None):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.path = path or EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or EMBEDDING_CACHE_MAX_ENTRIES
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, kind TEXT NOT NULL, text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, kind, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def _count(self, key, n=1):
+        self.stats[key] += n
+        CACHE_STATS[key] += n
+        if key in ("hits", "misses"):
+            inc(f"cache_{key}_total", n, cache="embedding")
+
+    def _lookup(self, kind, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT text_hash, vector FROM embeddings"
+                    f" WHERE model = ? AND kind = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model, kind, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND kind = ? AND text_hash = ?",
+                    [(now, self.model, kind, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, kind, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, kind, text_hash, vector, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(self.model, kind, text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for text_hash, vector in items],
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN"
+                    " (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self._count("evictions", count - self.max_entries)
+            self._conn.commit()
+
+    def _embed(self, kind, texts, embed_batch):
+        # Documents and queries are cached apart: some providers embed them with different task types.
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        vectors = self._lookup(kind, hashes)
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        misses = sum(1 for text_hash in hashes if text_hash in missing)
+        self._count("hits", len(texts) - misses)
+        self._count("misses", misses)
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            self._count("api_calls")
+            with span("embedding"):
+                new_vectors = embed_batch([text for _, text in batch])
+            fresh = [(text_hash, vector) for (text_hash, _), vector in zip(batch, new_vectors)]
+            self._store(kind, fresh)
+            vectors.update(fresh)
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed("document", list(texts), self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    def embed_queries(self, texts):
+        """Embeds many queries with batched requests instead of one request per query."""
+        return self._embed("query", list(texts), lambda batch: embed_query_batch(self.embeddings, batch))
+
+
+def embed_query_batch(embeddings, texts):
+    """One request for many queries; passes the query task type to providers that distinguish it."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        return embeddings.embed_documents(texts, task_type="retrieval_query")
+    return embeddings.embed_documents(texts)
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+
+import openai
+
+from extraction_cache import chunk_hash
+from metrics import inc, span
+
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "4"))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "60"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
+EXTRACTION_MAX_RETRIES = int(os.getenv("EXTRACTION_MAX_RETRIES", "5"))
+
+# Room reserved in the token budget for the model's reply.
+EXPECTED_COMPLETION_TOKENS = 1500
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text.
+    return len(text) // 4 + 1
+
+
+def as_messages(prompt):
+    """A prompt is either a list of chat messages or a string sent as the system message."""
+    return prompt if isinstance(prompt, list) else [{"role": "system", "content": prompt}]
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute, shared by every caller."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.limits = (requests_per_minute, tokens_per_minute)
+        self.available = [float(requests_per_minute), float(tokens_per_minute)]
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for i, limit in enumerate(self.limits):
+            self.available[i] = min(limit, self.available[i] + elapsed * limit / 60)
+
+    async def acquire(self, tokens: int):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Holding the lock while waiting keeps callers in arrival order.
+        async with self._lock:
+            need = (1, min(tokens, self.limits[1]))
+            while True:
+                self._refill()
+                waits = [(need[i] - self.available[i]) * 60 / self.limits[i] for i in range(2)]
+                if max(waits) <= 0:
+                    self.available[0] -= need[0]
+                    self.available[1] -= need[1]
+                    return
+                await asyncio.sleep(max(waits))
+
+
+@dataclass
+class ChunkResult:
+    index: int
+    content: str = None
+    error: Exception = None
+    attempts: int = 0
+    usage: dict = field(default_factory=dict)
+    cached: bool = False
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        # Exponential backoff with full jitter, capped at 30 seconds.
+        return random.uniform(0, min(30.0, 2 ** attempt))
+
+
+class ExtractionEngine:
+    """
+    Sends one chat completion per chunk with bounded concurrency, a shared rate limit,
+    and per-chunk retries with backoff on 429s, 5xxs and connection errors. A chunk that
+    still fails is reported in its ChunkResult; the other chunks are unaffected.
+
+    With a `cache` (an ExtractionCache), chunks already extracted with the same model,
+    temperature, `prompt_version` and prompt are answered from it without calling the API.
+
+    `prompt_fn` is either a function of the chunk or a list with one prompt per chunk, for
+    prompts that depend on where the chunk sits in its document.
+    """
+
+    def __init__(self, client, model: str = "gpt-4-turbo", temperature: float = 0.0,
+                 concurrency: int = None, requests_per_minute: int = None,
+                 tokens_per_minute: int = None, max_retries: int = None,
+                 cache=None, prompt_version: str = None):
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+        self.cache = cache
+        self.prompt_version = prompt_version
+        self.concurrency = concurrency or EXTRACTION_CONCURRENCY
+        self.max_retries = EXTRACTION_MAX_RETRIES if max_retries is None else max_retries
+        self.limiter = RateLimiter(requests_per_minute or OPENAI_REQUESTS_PER_MINUTE,
+                                   tokens_per_minute or OPENAI_TOKENS_PER_MINUTE)
+        self._semaphore = None
+
+    async def extract_one(self, index: int, prompt, temperature: float = None, stage: str = "extraction") -> ChunkResult:
+        """
+        Sends one prompt through the engine's concurrency limit, rate limit and retries.
+        Other calls to the same API (e.g. question answering) go through here too, with
+        their own `temperature` and the `stage` they are counted under.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        result = ChunkResult(index)
+        messages = as_messages(prompt)
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        async with self._semaphore:
+            while True:
+                result.attempts += 1
+                await self.limiter.acquire(prompt_tokens + EXPECTED_COMPLETION_TOKENS)
+                try:
+                    with span("llm"):
+                        response = await self.client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            temperature=self.temperature if temperature is None else temperature,
+                        )
+                    if not response.choices:
+                        raise ValueError("OpenAI API did not return choices.")
+                    result.content = response.choices[0].message.content
+                    if response.usage is not None:
+                        # Prompt tokens served from the provider's prompt cache (shared prefixes).
+                        details = getattr(response.usage, "prompt_tokens_details", None)
+                        cached_tokens = getattr(details, "cached_tokens", None) or 0
+                        result.usage = {"prompt_tokens": response.usage.prompt_tokens,
+                                        "completion_tokens": response.usage.completion_tokens,
+                                        "cached_tokens": cached_tokens}
+                        inc("tokens_sent_total", response.usage.prompt_tokens, model=self.model)
+                        inc("tokens_cached_total", cached_tokens, model=self.model)
+                        inc("tokens_received_total", response.usage.completion_tokens, model=self.model)
+                    inc("chunks_processed_total", stage=stage)
+                    return result
+                except Exception as e:
+                    if not is_retryable(e) or result.attempts > self.max_retries:
+                        result.error = e
+                        return result
+                    inc("api_retries_total", model=self.model, error=type(e).__name__)
+                    await asyncio.sleep(retry_delay(e, result.attempts))
+
+    async def extract_chunk(self, index: int, chunk: str, prompt_fn) -> ChunkResult:
+        prompt = prompt_fn[index] if isinstance(prompt_fn, list) else prompt_fn(chunk)
+        if self.cache is None:
+            return await self.extract_one(index, prompt)
+        # Keyed by the whole prompt, since the same chunk can be sent with different instructions.
+        digest = chunk_hash(json.dumps(as_messages(prompt), sort_keys=True))
+        key = (self.model, self.temperature, self.prompt_version or "", digest)
+        hit = self.cache.get(*key)
+        if hit is not None:
+            inc("cache_hits_total", cache="extraction")
+            return ChunkResult(index, content=hit[0], usage=hit[1], cached=True)
+        inc("cache_misses_total", cache="extraction")
+        result = await self.extract_one(index, prompt)
+        if result.error is None:
+            self.cache.put(*key, result.content, result.usage)
+        return result
+
+    async def iter_extract(self, chunks, prompt_fn):
+        """Yields a ChunkResult for each chunk as soon as it finishes, in completion order."""
+        tasks = [asyncio.ensure_future(self.extract_chunk(i, chunk, prompt_fn)) for i, chunk in enumerate(chunks)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def extract(self, chunks, prompt_fn):
+        """Returns one ChunkResult per chunk, in chunk order."""
+        results = [None] * len(chunks)
+        async for result in self.iter_extract(chunks, prompt_fn):
+            results[result.index] = result
+        return results
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(".cache", "extractions.sqlite"))
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Stores LLM extraction results keyed by (model, temperature, prompt version, chunk hash).
+
+    The prompt version is a label the caller bumps whenever its extraction prompt changes;
+    results stored under older versions are never returned, and invalidate() deletes them.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or EXTRACTION_CACHE_PATH
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " model TEXT NOT NULL, temperature REAL NOT NULL, prompt_version TEXT NOT NULL,"
+            " chunk_hash TEXT NOT NULL, content TEXT NOT NULL, usage TEXT NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (model, temperature, prompt_version, chunk_hash))"
+        )
+        self._conn.commit()
+
+    def get(self, model: str, temperature: float, prompt_version: str, digest: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, usage FROM extractions"
+                " WHERE model = ? AND temperature = ? AND prompt_version = ? AND chunk_hash = ?",
+                (model, temperature, prompt_version, digest),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, model: str, temperature: float, prompt_version: str, digest: str, content: str, usage: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (model, temperature, prompt_version, digest, content, json.dumps(usage), time.time()),
+            )
+            self._conn.commit()
+
+    def invalidate(self, prompt_version: str = None, keep_version: str = None) -> int:
+        """
+        Deletes cached results for one prompt version, for every version except `keep_version`,
+        or everything when neither is given. Returns the number of rows removed.
+        """
+        with self._lock:
+            if prompt_version is not None:
+                cursor = self._conn.execute("DELETE FROM extractions WHERE prompt_version = ?", (prompt_version,))
+            elif keep_version is not None:
+                cursor = self._conn.execute("DELETE FROM extractions WHERE prompt_version != ?", (keep_version,))
+            else:
+                cursor = self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,66 @@
+import re
+
+from extraction import estimate_tokens
+
+CASE_STUDY = re.compile(r"\bcase\s*study\b", re.IGNORECASE)
+
+# Goes into the user message of every chunk after the first one of a case study, so the
+# system message stays identical for all chunks.
+LATER_CASE_STUDY_CHUNK = (
+    "This is a later part of a case study assessment. The case study context was extracted from "
+    "the first part, so return \"case_study_context\": \"\" and extract only the content below."
+)
+
+
+def classify_assessment(text: str) -> str:
+    """case_study or written_assessment, decided once from the whole document."""
+    return "case_study" if CASE_STUDY.search(text) else "written_assessment"
+
+
+def chunk_messages(instructions: str, chunk: str, note: str = None):
+    """The instructions as a stable system message, followed by the chunk as the user message."""
+    content = f"Document content:\n{chunk}" if note is None else f"{note}\n\nDocument content:\n{chunk}"
+    return [{"role": "system", "content": instructions}, {"role": "user", "content": content}]
+
+
+def document_prompts(text: str, chunks, instructions: dict):
+    """
+    Builds one prompt per chunk of a document. `instructions` maps each assessment type to
+    its system message.
+
+    The document is classified once, so every chunk gets the same instructions. Only the
+    first chunk of a case study, which holds the context, is asked to extract the case study
+    context. The later chunks are told it has already been taken.
+
+    The instruction prefix is byte-identical across chunks, but OpenAI only caches prompts
+    of 1024 tokens or more, on models that support prompt caching. The instructions are
+    shorter than that and gpt-4-turbo has no prompt caching, so cached_prompt_tokens stays
+    0 until either changes.
+
+    Returns (prompts, report). The report holds token estimates for the prompts, and
+    add_usage() completes it with the usage the provider reports.
+    """
+    assessment_type = classify_assessment(text)
+    system = instructions[assessment_type]
+    case_study = assessment_type == "case_study"
+    prompts = [chunk_messages(system, chunk, LATER_CASE_STUDY_CHUNK if case_study and i else None)
+               for i, chunk in enumerate(chunks)]
+
+    later_chunks = max(0, len(chunks) - 1) if case_study else 0
+    report = {
+        "assessment_type": assessment_type,
+        "chunks": len(chunks),
+        "instruction_tokens": estimate_tokens(system),
+        # Prompt tokens added by the note telling later case study chunks the context was already extracted.
+        "note_tokens": estimate_tokens(LATER_CASE_STUDY_CHUNK) * later_chunks,
+    }
+    return prompts, report
+
+
+def add_usage(report: dict, results):
+    """Adds the provider-reported usage of a document's ChunkResults."""
+    usage = [result.usage for result in results if result is not None and not result.cached]
+    report["prompt_tokens"] = sum(u.get("prompt_tokens", 0) for u in usage)
+    report["completion_tokens"] = sum(u.get("completion_tokens", 0) for u in usage)
+    report["cached_prompt_tokens"] = sum(u.get("cached_tokens", 0) for u in usage)
+    return report
@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from index_store import IndexHandle
+
+# Each collection (a course, an exam, a session...) has its own index directory. The default
+# collection keeps using faiss_index/, so indexes built before collections existed still load.
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_ROOT = os.getenv("COLLECTIONS_ROOT", "collections")
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+INDEX_CACHE_MAX_COLLECTIONS = int(os.getenv("INDEX_CACHE_MAX_COLLECTIONS", "16"))
+
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def collection_path(name: str = None) -> str:
+    """The index directory of collection `name`; raises ValueError for names that are not safe as a directory."""
+    name = name or DEFAULT_COLLECTION
+    if not COLLECTION_NAME.match(name) or ".." in name:
+        raise ValueError(f"Invalid collection name {name!r}: use letters, digits, '.', '_' or '-' (max 64).")
+    if name == DEFAULT_COLLECTION:
+        return "faiss_index"
+    return os.path.join(COLLECTIONS_ROOT, name)
+
+
+def collection_exists(name: str = None) -> bool:
+    return os.path.exists(os.path.join(collection_path(name), "index.faiss"))
+
+
+def list_collections():
+    names = [DEFAULT_COLLECTION] if collection_exists(DEFAULT_COLLECTION) else []
+    if os.path.isdir(COLLECTIONS_ROOT):
+        names.extend(sorted(name for name in os.listdir(COLLECTIONS_ROOT)
+                            if COLLECTION_NAME.match(name) and collection_exists(name)))
+    return names
+
+
+class IndexCache:
+    """
+    Keeps the IndexHandles of recently used collections, evicting the least recently used
+    ones once the loaded indexes exceed `max_bytes` on disk or `max_collections` in number.
+    The collection being returned is never evicted, even if it alone is over budget.
+    """
+
+    def __init__(self, embeddings, max_bytes: int = None, max_collections: int = None):
+        self.embeddings = embeddings
+        self.max_bytes = max_bytes or INDEX_CACHE_MAX_BYTES
+        self.max_collections = max_collections or INDEX_CACHE_MAX_COLLECTIONS
+        self.evictions = 0
+        self._handles = OrderedDict()  # collection -> IndexHandle, least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(handle) -> int:
+        return sum(size or 0 for _, _, size in handle._current_signature())
+
+    def get(self, name: str = None) -> IndexHandle:
+        name = name or DEFAULT_COLLECTION
+        path = collection_path(name)
+        with self._lock:
+            handle = self._handles.pop(name, None) or IndexHandle(path, self.embeddings)
+            self._handles[name] = handle
+            sizes = {key: self._size(value) for key, value in self._handles.items()}
+            total = sum(sizes.values())
+            for key in list(self._handles):
+                if key == name:
+                    continue
+                if total <= self.max_bytes and len(self._handles) <= self.max_collections:
+                    break
+                del self._handles[key]
+                total -= sizes[key]
+                self.evictions += 1
+        return handle
+
+    def evict(self, name: str = None):
+        with self._lock:
+            self._handles.pop(name or DEFAULT_COLLECTION, None)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._handles)
@@ -0,0 +1,181 @@
+"""
+Builds compressed or approximate FAISS indexes for get_vector_store, and compares them with
+the exact flat index.
+
+FAISS_INDEX_TYPE selects the index: flat (exact, the default), hnsw, ivf, ivf_sq8 or ivf_pq.
+IVF indexes are trained on a random sample of at most FAISS_TRAIN_SAMPLE vectors. Search
+breadth is tuned at query time with FAISS_NPROBE (IVF) and FAISS_EF_SEARCH (HNSW).
+
+    python index_factory.py --index faiss_index --k 4
+
+prints recall@k, query latency and index size of every index type against the flat index
+built from the same vectors.
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivf_sq8", "ivf_pq")
+
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "0"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "50000"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+# FAISS wants roughly 39 training points per centroid: per IVF list, and per code of each
+# 8-bit PQ sub-quantizer (256 codes).
+MIN_POINTS_PER_LIST = 39
+MIN_PQ_POINTS = 39 * 256
+
+
+def _pq_subquantizers(dim: int) -> int:
+    if FAISS_PQ_M and dim % FAISS_PQ_M == 0:
+        return FAISS_PQ_M
+    m = min(64, max(1, dim // 4))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def factory_string(kind: str, dim: int, count: int):
+    """The faiss.index_factory description for `kind`, or None when there are too few vectors to train it."""
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{FAISS_HNSW_M}"
+    nlist = FAISS_NLIST or max(1, int(4 * math.sqrt(count)))
+    nlist = min(nlist, count // MIN_POINTS_PER_LIST)
+    if nlist < 1 or (kind == "ivf_pq" and count < MIN_PQ_POINTS):
+        return None
+    if kind == "ivf":
+        return f"IVF{nlist},Flat"
+    if kind == "ivf_sq8":
+        return f"IVF{nlist},SQ8"
+    if kind == "ivf_pq":
+        return f"IVF{nlist},PQ{_pq_subquantizers(dim)}"
+    raise ValueError(f"Unknown FAISS index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}.")
+
+
+def build_index(vectors, kind: str = None):
+    """
+    Builds an index of type `kind` (default FAISS_INDEX_TYPE) holding `vectors` in order, so
+    position i is row i. Falls back to a flat index when there is too little data to train.
+    """
+    kind = (kind or FAISS_INDEX_TYPE).lower()
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    description = factory_string(kind, dim, count) or "Flat"
+    index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    if not index.is_trained:
+        sample = vectors
+        if count > FAISS_TRAIN_SAMPLE:
+            rows = np.random.default_rng(0).choice(count, FAISS_TRAIN_SAMPLE, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    index.add(vectors)
+    apply_search_params(index)
+    return index
+
+
+def apply_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Sets query-time search breadth on IVF (nprobe) and HNSW (efSearch) indexes; no-op otherwise."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe or FAISS_NPROBE
+    except RuntimeError:
+        pass
+    hnsw_index = faiss.downcast_index(index)
+    if hasattr(hnsw_index, "hnsw"):
+        hnsw_index.hnsw.efSearch = ef_search or FAISS_EF_SEARCH
+    return index
+
+
+def index_kind(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    return "ivf"
+
+
+def all_vectors(index):
+    """Every vector in position order. Exact for flat, HNSW, IVF-Flat and SQ8; approximate for PQ."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def recall_report(vectors, kinds=INDEX_TYPES, k: int = 4, n_queries: int = 200, nprobe: int = None,
+                  ef_search: int = None):
+    """
+    Recall@k of each index type against the exact flat index, with per-query latency and
+    serialized size. Queries are stored vectors with a little noise added.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(0, queries.std() * 0.05, queries.shape).astype(np.float32)
+
+    exact = build_index(vectors, "flat")
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for kind in kinds:
+        started = time.perf_counter()
+        index = build_index(vectors, kind)
+        build_seconds = time.perf_counter() - started
+        apply_search_params(index, nprobe, ef_search)
+        latencies = []
+        found = []
+        for query in queries:
+            started = time.perf_counter()
+            _, positions = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - started)
+            found.append(positions[0])
+        hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+        latencies_ms = np.asarray(latencies) * 1000
+        report.append({
+            "index_type": kind,
+            "effective": factory_string(kind, vectors.shape[1], len(vectors)) or "Flat",
+            f"recall@{k}": round(hits / truth.size, 4),
+            "query_p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+            "query_p95_ms": round(float(np.percentile(latencies_ms, 95)), 4),
+            "size_bytes": int(faiss.serialize_index(index).size),
+            "build_seconds": round(build_seconds, 3),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of FAISS index types against the flat index.")
+    parser.add_argument("--index", default="faiss_index", help="directory holding index.faiss")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    # Prefer the exact vectors kept next to approximate indexes over reconstructing them.
+    sidecar = os.path.join(args.index, "vectors.npy")
+    if os.path.exists(sidecar):
+        vectors = np.load(sidecar)
+    else:
+        vectors = all_vectors(faiss.read_index(os.path.join(args.index, "index.faiss")))
+    print(json.dumps(recall_report(vectors, k=args.k, n_queries=args.queries, nprobe=args.nprobe,
+                                   ef_search=args.ef_search), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from chunk_store import CHUNK_PURGE_GRACE_SECONDS, IDS_NAME, INDEX_NAME, empty_store, load_store, migrate_pickle, save_store
+from index_factory import FAISS_INDEX_TYPE, all_vectors, apply_search_params, build_index, index_kind
+from metrics import inc, span
+
+# Lives next to index.faiss / ids.json / chunks.sqlite and records which chunks of which document are in the index.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Name under which the chunks of an index written before manifests existed are kept.
+LEGACY_DOCUMENT = "legacy index"
+# Full-precision copy of the vectors, kept only for approximate index types so that updates
+# rebuild from exact vectors. It is never loaded to answer queries.
+VECTORS_NAME = "vectors.npy"
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embedding_model_name(embeddings) -> str:
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+def load_manifest(path: str):
+    try:
+        with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(path: str, manifest: dict):
+    target = os.path.join(path, MANIFEST_NAME)
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, target)
+
+
+def _flat_copy(path: str, index):
+    """An exact IndexFlatL2 with the same vectors in the same positions, for applying updates."""
+    vectors = None
+    try:
+        vectors = np.load(os.path.join(path, VECTORS_NAME), mmap_mode="r")
+        if vectors.shape[0] != index.ntotal:
+            vectors = None
+    except (FileNotFoundError, ValueError):
+        pass
+    if vectors is None:
+        vectors = all_vectors(index)
+    flat = faiss.IndexFlatL2(index.d)
+    if len(vectors):
+        flat.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return flat
+
+
+def save_index(path: str, vector_store):
+    """Writes the store with the configured index type, rebuilding approximate indexes from the exact vectors."""
+    sidecar = os.path.join(path, VECTORS_NAME)
+    if FAISS_INDEX_TYPE == "flat":
+        save_store(path, vector_store)
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+        return
+    vectors = all_vectors(vector_store.index)
+    os.makedirs(path, exist_ok=True)
+    np.save(sidecar, vectors)
+    vector_store.index = build_index(vectors, FAISS_INDEX_TYPE)
+    save_store(path, vector_store)
+
+
+def chunk_id(name: str, chunk_hash: str, n: int) -> str:
+    """Docstore id of the n-th (from 0) chunk of document `name` whose text hashes to `chunk_hash`."""
+    return f"{sha256(name)[:16]}:{chunk_hash}:{n}"
+
+
+def _chunk_ids(name: str, chunk_hashes):
+    """Stable docstore ids: one per chunk, unique even when a chunk repeats inside a document."""
+    seen = {}
+    ids = []
+    for chunk_hash in chunk_hashes:
+        n = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = n + 1
+        ids.append(chunk_id(name, chunk_hash, n))
+    return ids
+
+
+def sync_documents(documents, embeddings, path: str = "faiss_index", prune: bool = False):
+    """
+    Brings the FAISS index at `path` in line with `documents`, a list of (name, chunks).
+
+    Unchanged documents are skipped, changed ones have their stale chunks deleted and only
+    their new chunks added, and with prune=True documents missing from `documents` are
+    removed from the index. A chunk whose text is already in the index reuses the stored
+    vector, so the embedding API only ever sees chunk text it has not embedded before.
+
+    Returns a dict of counts (added, embedded, reused, deleted, unchanged_documents).
+    """
+    with span("index_update"):
+        stats = _sync_documents(documents, embeddings, path, prune)
+    inc("chunks_processed_total", stats["embedded"], stage="embedding")
+    return stats
+
+
+def _legacy_manifest(vector_store, model: str):
+    """
+    A manifest for an index written without one: all of its vectors become the document
+    LEGACY_DOCUMENT, assumed to be embedded with the current model, so the next update adds
+    to them instead of replacing them with the upload alone.
+    """
+    ids = [vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal)]
+    chunk_hashes = []
+    for doc_id in ids:
+        doc = vector_store.docstore.search(doc_id)
+        chunk_hashes.append(sha256(doc.page_content if hasattr(doc, "page_content") else doc_id))
+    legacy = {"sha256": sha256("\0".join(chunk_hashes)), "chunks": chunk_hashes, "ids": ids}
+    return {"version": MANIFEST_VERSION, "embedding_model": model, "index_type": index_kind(vector_store.index),
+            "documents": {LEGACY_DOCUMENT: legacy} if ids else {}}
+
+
+def open_index(path: str, embeddings):
+    """
+    Opens the index at `path` for updating: returns (vector_store, manifest), with the store
+    holding an exact flat index, or (None, empty manifest) when it has to be built anew.
+    An index without a manifest is kept, as the document LEGACY_DOCUMENT.
+    """
+    model = embedding_model_name(embeddings)
+    manifest = load_manifest(path)
+    vector_store = None
+    if manifest is None or manifest.get("embedding_model") == model:
+        try:
+            vector_store = load_store(path, embeddings)
+        except Exception:
+            vector_store = None
+    if vector_store is None:
+        # No index, a different embedding model, or an unreadable index: start over.
+        manifest = {"version": MANIFEST_VERSION, "embedding_model": model, "documents": {}}
+    elif manifest is None:
+        manifest = _legacy_manifest(vector_store, model)
+    elif index_kind(vector_store.index) != "flat":
+        # Updates are applied to an exact copy; the approximate index is rebuilt on save.
+        vector_store.index = _flat_copy(path, vector_store.index)
+    return vector_store, manifest
+
+
+def _sync_documents(documents, embeddings, path: str, prune: bool):
+    vector_store, manifest = open_index(path, embeddings)
+    rebuild = manifest.get("index_type", "flat") != FAISS_INDEX_TYPE
+    manifest["index_type"] = FAISS_INDEX_TYPE
+
+    known = manifest["documents"]
+    stats = {"added": 0, "embedded": 0, "reused": 0, "deleted": 0, "unchanged_documents": 0}
+
+    # chunk hash -> position of a vector already in the index holding that text
+    positions = {}
+    if vector_store is not None:
+        id_to_position = {doc_id: pos for pos, doc_id in vector_store.index_to_docstore_id.items()}
+        for entry in known.values():
+            for chunk_hash, doc_id in zip(entry["chunks"], entry["ids"]):
+                if doc_id in id_to_position:
+                    positions.setdefault(chunk_hash, id_to_position[doc_id])
+
+    to_delete, to_add = [], []
+    incoming = set()
+    for name, chunks in documents:
+        incoming.add(name)
+        chunk_hashes = [sha256(chunk) for chunk in chunks]
+        doc_hash = sha256("\0".join(chunk_hashes))
+        old = known.get(name)
+        if old is not None and old["sha256"] == doc_hash:
+            stats["unchanged_documents"] += 1
+            continue
+
+        ids = _chunk_ids(name, chunk_hashes)
+        old_ids = set(old["ids"]) if old else set()
+        new_ids = set(ids)
+        to_delete.extend(doc_id for doc_id in old_ids if doc_id not in new_ids)
+        for chunk, chunk_hash, doc_id in zip(chunks, chunk_hashes, ids):
+            if doc_id not in old_ids:
+                to_add.append((name, chunk, chunk_hash, doc_id))
+        known[name] = {"sha256": doc_hash, "chunks": chunk_hashes, "ids": ids}
+
+    if prune:
+        for name in [name for name in known if name not in incoming]:
+            to_delete.extend(known.pop(name)["ids"])
+
+    if not to_delete and not to_add and vector_store is not None and not rebuild:
+        return stats
+
+    # Pull reusable vectors out before deleting anything, since deletes renumber positions.
+    vectors = {}
+    for _, _, chunk_hash, _ in to_add:
+        if chunk_hash in positions and chunk_hash not in vectors:
+            vectors[chunk_hash] = vector_store.index.reconstruct(positions[chunk_hash]).tolist()
+    missing = {}
+    for _, chunk, chunk_hash, _ in to_add:
+        if chunk_hash not in vectors:
+            missing.setdefault(chunk_hash, chunk)
+    if missing:
+        for chunk_hash, vector in zip(missing, embeddings.embed_documents(list(missing.values()))):
+            vectors[chunk_hash] = vector
+    stats["embedded"] = len(missing)
+    stats["reused"] = len(to_add) - len(missing)
+
+    if to_delete and vector_store is not None:
+        present = set(vector_store.index_to_docstore_id.values())
+        to_delete = [doc_id for doc_id in to_delete if doc_id in present]
+        if to_delete:
+            vector_store.delete(to_delete)
+        stats["deleted"] = len(to_delete)
+
+    if to_add:
+        text_embeddings = [(chunk, vectors[chunk_hash]) for _, chunk, chunk_hash, _ in to_add]
+        metadatas = [{"source": name, "chunk_hash": chunk_hash} for name, _, chunk_hash, _ in to_add]
+        ids = [doc_id for _, _, _, doc_id in to_add]
+        if vector_store is None:
+            vector_store = empty_store(path, embeddings, len(text_embeddings[0][1]))
+        vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        stats["added"] = len(to_add)
+
+    if vector_store is not None:
+        save_index(path, vector_store)
+        save_manifest(path, manifest)
+    return stats
+
+
+class IndexHandle:
+    """
+    A FAISS index loaded once and shared by every caller in the process.
+
+    get() compares the modification times of the files under `path` against the copy in
+    memory. When they change, a background thread loads the new index and swaps it in;
+    readers keep getting the old copy until the swap, so a reload never blocks a query.
+    The exception is a copy so old that chunks it refers to may have been purged from
+    chunks.sqlite: that one is replaced before get() returns.
+    `version` identifies the copy currently in memory.
+    """
+
+    FILES = (INDEX_NAME, IDS_NAME, MANIFEST_NAME)
+
+    def __init__(self, path: str, embeddings):
+        self.path = path
+        self.embeddings = embeddings
+        self._store = None
+        self._signature = None
+        self.version = None
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def _current_signature(self):
+        signature = []
+        for name in self.FILES:
+            try:
+                st = os.stat(os.path.join(self.path, name))
+                signature.append((name, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append((name, None, None))
+        return tuple(signature)
+
+    def _load(self, signature):
+        try:
+            # An index.pkl from before chunks.sqlite is converted once, which changes the files.
+            if migrate_pickle(self.path):
+                signature = self._current_signature()
+            store = load_store(self.path, self.embeddings)
+            apply_search_params(store.index)
+            # A writer finished mid-load: keep the old copy and try again on the next get().
+            if self._current_signature() == signature:
+                self._store, self._signature = store, signature
+                self.version = sha256(repr((self.path, signature)))[:16]
+        finally:
+            self._reloading = False
+
+    def _outlived_grace(self, signature):
+        # Chunks are purged at a save at least the grace period after the save that dropped
+        # them, which came after the copy in memory was written.
+        old, new = self._signature[0][1], signature[0][1]
+        return old is not None and new is not None and (new - old) / 1e9 > CHUNK_PURGE_GRACE_SECONDS
+
+    def get(self):
+        signature = self._current_signature()
+        if signature == self._signature:
+            return self._store
+        with self._lock:
+            if self._store is None:
+                self._reloading = True
+                self._load(signature)
+                if self._store is None:
+                    raise RuntimeError(f"Index at {self.path} changed while it was being loaded; try again.")
+            elif not self._reloading and signature != self._signature:
+                self._reloading = True
+                if self._outlived_grace(signature):
+                    self._load(signature)
+                else:
+                    threading.Thread(target=self._load, args=(signature,), daemon=True).start()
+        return self._store
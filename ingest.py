@@ -0,0 +1,324 @@
+"""
+Streaming ingest of one PDF into an index, with a fixed memory ceiling.
+
+Pages are extracted a few ranges ahead, split into chunks as they arrive, embedded
+INGEST_BATCH_CHUNKS at a time and appended to the index. Nothing holds the whole document:
+at any moment there is one batch of chunks, the splitter's current piece and chunk, and the
+list of chunk hashes for the manifest.
+
+Every INGEST_CHECKPOINT_CHUNKS chunks the index is saved along with a checkpoint (pages
+done, the splitter state and the chunk hashes so far). An interrupted ingest of the same file
+into the same index resumes from there instead of starting over.
+"""
+import hashlib
+import json
+import os
+from collections import Counter, deque
+
+from chunk_store import empty_store, save_store
+from index_factory import FAISS_INDEX_TYPE
+from index_store import chunk_id, open_index, save_index, save_manifest, sha256
+from metrics import inc, span
+from pdf_extract import iter_pages, page_count, read_pdf_bytes
+
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "64"))
+INGEST_CHECKPOINT_CHUNKS = int(os.getenv("INGEST_CHECKPOINT_CHUNKS", "512"))
+CHECKPOINT_NAME = "ingest_checkpoint.json"
+
+
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+class _Level:
+    """
+    One level of RecursiveCharacterTextSplitter: the text is cut into pieces at the level's
+    separator (kept at the start of the piece that follows it), runs of pieces shorter than
+    chunk_size are merged into chunks exactly as TextSplitter._merge_splits does, and every
+    longer piece is split on its own at the next level.
+
+    Only the piece being read and the chunk being merged are held. A piece is handed to the
+    next level as soon as it reaches chunk_size, so it can be as long as it likes.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, depth: int = 0, state: dict = None):
+        self.chunk_size, self.chunk_overlap, self.depth = chunk_size, chunk_overlap, depth
+        self.separator = SEPARATORS[depth]
+        state = state or {}
+        self.rest = state.get("rest", "")    # the end of the text so far, if it may start a separator
+        self.piece = state.get("piece", "")  # the piece being read, while it is shorter than chunk_size
+        self.doc = deque(state.get("doc", []))  # the pieces merged into the next chunk
+        self.total = sum(map(len, self.doc))
+        self.child = None if state.get("child") is None else self._next_level(state["child"])
+
+    def _next_level(self, state: dict = None):
+        return _Level(self.chunk_size, self.chunk_overlap, self.depth + 1, state)
+
+    def state(self) -> dict:
+        return {"rest": self.rest, "piece": self.piece, "doc": list(self.doc),
+                "child": None if self.child is None else self.child.state()}
+
+    def feed(self, text: str, out: list):
+        if not self.separator:
+            for char in text:
+                self._merge(char, out)
+            return
+        text = self.rest + text
+        width = len(self.separator)
+        start = searched = 0
+        match = text.find(self.separator)
+        while match != -1:
+            self._extend(text[start:match], out)
+            self._end_piece(out)
+            start, searched = match, match + width
+            match = text.find(self.separator, searched)
+        # A separator may be cut in two by the end of the text; keep its first part back.
+        keep = next((n for n in range(width - 1, 0, -1)
+                     if len(text) - n >= searched and text.endswith(self.separator[:n])), 0)
+        self._extend(text[start:len(text) - keep], out)
+        self.rest = text[len(text) - keep:]
+
+    def finish(self, out: list):
+        if self.separator:
+            self._extend(self.rest, out)
+            self.rest = ""
+            self._end_piece(out)
+        self._flush(out)
+
+    def _extend(self, text: str, out: list):
+        if self.child is not None:
+            self.child.feed(text, out)
+            return
+        self.piece += text
+        if len(self.piece) >= self.chunk_size:
+            # Too long to merge: the run so far is closed and the piece is split by itself.
+            self._flush(out)
+            self.child = self._next_level()
+            self.child.feed(self.piece, out)
+            self.piece = ""
+
+    def _end_piece(self, out: list):
+        if self.child is not None:
+            self.child.finish(out)
+            self.child = None
+        elif self.piece:
+            self._merge(self.piece, out)
+            self.piece = ""
+
+    def _merge(self, piece: str, out: list):
+        if self.total + len(piece) > self.chunk_size:
+            self._emit(out)
+            while self.doc and (self.total > self.chunk_overlap or self.total + len(piece) > self.chunk_size):
+                self.total -= len(self.doc.popleft())
+        self.doc.append(piece)
+        self.total += len(piece)
+
+    def _emit(self, out: list):
+        chunk = "".join(self.doc).strip()
+        if chunk:
+            out.append(chunk)
+
+    def _flush(self, out: list):
+        self._emit(out)
+        self.doc.clear()
+        self.total = 0
+
+
+class StreamingSplitter:
+    """
+    Splits text that arrives piece by piece into exactly the chunks
+    RecursiveCharacterTextSplitter(chunk_size, chunk_overlap).split_text() makes of the whole
+    text. Picking the first separator found in the text, as the splitter does, gives the
+    same chunks as always starting from "\n\n" and going down a level for pieces that are
+    too long, and the latter can be done as the text arrives.
+
+    state() is JSON-serializable and can be passed back in to carry on where it left off.
+    """
+
+    def __init__(self, chunk_size: int = 10000, chunk_overlap: int = 1000, state: dict = None):
+        self.root = _Level(chunk_size, chunk_overlap, state=state)
+
+    def feed(self, text: str):
+        chunks = []
+        self.root.feed(text, chunks)
+        return chunks
+
+    def finish(self):
+        chunks = []
+        self.root.finish(chunks)
+        return chunks
+
+    def state(self) -> dict:
+        return self.root.state()
+
+
+def _checkpoint_path(path: str) -> str:
+    return os.path.join(path, CHECKPOINT_NAME)
+
+
+def _read_checkpoint(path: str):
+    try:
+        with open(_checkpoint_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_checkpoint(path: str, name: str, file_hash: str):
+    """The saved state of an interrupted ingest of this exact file, or None."""
+    state = _read_checkpoint(path)
+    if state is None or state.get("document") != name or state.get("file_sha256") != file_hash:
+        return None
+    return state
+
+
+def _save_checkpoint(path: str, state: dict):
+    target = _checkpoint_path(path)
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, target)
+
+
+def ingest_pdf(pdf, name: str, embeddings, path: str = "faiss_index", progress=None, max_workers: int = None,
+               chunk_size: int = 10000, chunk_overlap: int = 1000):
+    """
+    Adds or replaces document `name` (an uploaded file or a path) in the index at `path`,
+    streaming pages -> chunks -> embedding batches -> index appends.
+
+    Chunks already in the index under the same id are not embedded again. Chunks of a
+    previous version of the document that are gone are deleted at the end, and so are the
+    chunks an interrupted ingest of another file left behind when it is not resumed.
+    `progress(pages_done, total_pages, chunks_done)` is called after every page.
+
+    Returns a dict of counts (pages, chunks, embedded, reused, deleted, resumed_from_page).
+    """
+    data = read_pdf_bytes(pdf)
+    file_hash = hashlib.sha256(data).hexdigest()
+    total_pages = page_count(data)
+
+    vector_store, manifest = open_index(path, embeddings)
+    known = manifest["documents"]
+    old_ids = set(known[name]["ids"]) if name in known else set()
+    present = set(vector_store.index_to_docstore_id.values()) if vector_store is not None else set()
+
+    state = load_checkpoint(path, name, file_hash) if vector_store is not None else None
+    if state is None:
+        # A checkpoint of another file (or another version of this one) will not be resumed.
+        # The vectors it added belong to no document in the manifest; they are deleted at the
+        # end unless this ingest produces the same ids, and carried in our own checkpoint until then.
+        abandoned = _read_checkpoint(path) if vector_store is not None else None
+        owned = {doc_id for doc in known.values() for doc_id in doc["ids"]}
+        orphans = [doc_id for doc_id in (abandoned or {}).get("ids", []) + (abandoned or {}).get("orphans", [])
+                   if doc_id not in owned and doc_id in present]
+        state = {"document": name, "file_sha256": file_hash, "pages_done": 0, "splitter": None, "chunks": [], "ids": [],
+                 "orphans": orphans}
+    stats = {"pages": total_pages, "chunks": 0, "embedded": 0, "reused": 0, "deleted": 0,
+             "resumed_from_page": state["pages_done"]}
+    splitter = StreamingSplitter(chunk_size, chunk_overlap, state.get("splitter"))
+    seen = Counter(state["chunks"])
+    batch = []
+    since_checkpoint = 0
+
+    def flush():
+        nonlocal vector_store
+        if not batch:
+            return
+        vectors = embeddings.embed_documents([chunk for chunk, _, _ in batch])
+        if vector_store is None:
+            vector_store = empty_store(path, embeddings, len(vectors[0]))
+        vector_store.add_embeddings([(chunk, vector) for (chunk, _, _), vector in zip(batch, vectors)],
+                                    metadatas=[{"source": name, "chunk_hash": chunk_hash} for _, chunk_hash, _ in batch],
+                                    ids=[doc_id for _, _, doc_id in batch])
+        present.update(doc_id for _, _, doc_id in batch)
+        stats["embedded"] += len(batch)
+        inc("chunks_processed_total", len(batch), stage="embedding")
+        batch.clear()
+
+    def add(chunk):
+        nonlocal since_checkpoint
+        chunk_hash = sha256(chunk)
+        doc_id = chunk_id(name, chunk_hash, seen[chunk_hash])
+        seen[chunk_hash] += 1
+        state["chunks"].append(chunk_hash)
+        state["ids"].append(doc_id)
+        since_checkpoint += 1
+        if doc_id in present:
+            stats["reused"] += 1
+            return
+        batch.append((chunk, chunk_hash, doc_id))
+        if len(batch) >= INGEST_BATCH_CHUNKS:
+            flush()
+
+    try:
+        with span("ingest"):
+            for page in iter_pages(data, start=state["pages_done"], max_workers=max_workers):
+                for chunk in splitter.feed(page):
+                    add(chunk)
+                state["pages_done"] += 1
+                if since_checkpoint >= INGEST_CHECKPOINT_CHUNKS:
+                    # Text not yet made into chunks is carried in the splitter state.
+                    flush()
+                    state["splitter"] = splitter.state()
+                    save_store(path, vector_store)
+                    # The partial index is flat and must be openable on resume, even if it is new.
+                    manifest["index_type"] = "flat"
+                    save_manifest(path, manifest)
+                    _save_checkpoint(path, state)
+                    since_checkpoint = 0
+                if progress is not None:
+                    progress(state["pages_done"], total_pages, len(state["ids"]))
+            for chunk in splitter.finish():
+                add(chunk)
+            flush()
+
+            doc_hash = sha256("\0".join(state["chunks"]))
+            unchanged = name in known and known[name]["sha256"] == doc_hash and manifest.get("index_type") == FAISS_INDEX_TYPE
+            orphans = set(state.get("orphans", []))
+            if vector_store is not None and not (unchanged and stats["embedded"] == 0 and not orphans):
+                new_ids = set(state["ids"])
+                stale = [doc_id for doc_id in old_ids | orphans if doc_id not in new_ids and doc_id in present]
+                if stale:
+                    vector_store.delete(stale)
+                stats["deleted"] = len(stale)
+                known[name] = {"sha256": doc_hash, "chunks": state["chunks"], "ids": state["ids"]}
+                manifest["index_type"] = FAISS_INDEX_TYPE
+                save_index(path, vector_store)
+                save_manifest(path, manifest)
+    except BaseException:
+        # Chunks added since the last checkpoint are uncommitted; release the write lock now
+        # rather than whenever the connection is garbage collected.
+        if vector_store is not None:
+            vector_store.docstore.rollback()
+        raise
+    finally:
+        if vector_store is not None:
+            vector_store.docstore.close()
+
+    stats["chunks"] = len(state["ids"])
+    try:
+        os.remove(_checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+    return stats
+
+
+def prune_documents(keep, embeddings, path: str = "faiss_index") -> int:
+    """Removes every document not named in `keep` from the index; returns how many chunks were deleted."""
+    vector_store, manifest = open_index(path, embeddings)
+    known = manifest["documents"]
+    stale = [doc_id for name in [name for name in known if name not in keep] for doc_id in known.pop(name)["ids"]]
+    if vector_store is None:
+        return 0
+    try:
+        if not stale:
+            return 0
+        present = set(vector_store.index_to_docstore_id.values())
+        stale = [doc_id for doc_id in stale if doc_id in present]
+        if stale:
+            vector_store.delete(stale)
+        manifest["index_type"] = FAISS_INDEX_TYPE
+        save_index(path, vector_store)
+        save_manifest(path, manifest)
+        return len(stale)
+    finally:
+        vector_store.docstore.close()
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+
+from metrics import inc
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+# Finished jobs are kept for this long, and at most JOB_HISTORY of them, for GET /jobs/{id}.
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "500"))
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(".cache", "uploads"))
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when JOB_QUEUE_SIZE jobs are already waiting."""
+
+
+@dataclass
+class Job:
+    id: str
+    filename: str
+    path: str
+    params: dict = field(default_factory=dict)
+    status: str = "queued"  # queued -> running -> done | failed
+    stage: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    result: dict = None
+    error: str = None
+
+    def summary(self):
+        summary = asdict(self)
+        del summary["path"], summary["result"]
+        return summary
+
+
+class JobQueue:
+    """
+    A bounded queue of uploaded files processed by a fixed pool of asyncio workers.
+
+    submit() fails fast with QueueFull once `max_queued` jobs are waiting, so a burst of
+    uploads is turned away instead of piling up. `handler(job)` is a coroutine returning the
+    job's result; it can set job.stage to report progress. The spooled file is deleted when
+    the job finishes, whatever the outcome.
+    """
+
+    def __init__(self, handler, workers: int = None, max_queued: int = None):
+        self.handler = handler
+        self.workers = workers or JOB_WORKERS
+        self.max_queued = max_queued or JOB_QUEUE_SIZE
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        """Starts the workers; call from the running event loop (e.g. on application startup)."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queue, self._tasks = None, []
+
+    def new_job(self, filename: str, params: dict = None) -> Job:
+        """A job id and the spool path to write its upload to; the job is not queued yet."""
+        os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        return Job(job_id, filename, os.path.join(JOB_SPOOL_DIR, f"{job_id}.pdf"), params or {})
+
+    def submit(self, job: Job) -> int:
+        """Queues the job and returns its position in the queue (1 = next); raises QueueFull."""
+        self.start()
+        self._prune()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            inc("jobs_total", status="rejected")
+            raise QueueFull(f"{self.max_queued} jobs are already waiting.")
+        self.jobs[job.id] = job
+        inc("jobs_total", status="queued")
+        return self._queue.qsize()
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _prune(self):
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        excess = len(finished) - JOB_HISTORY
+        for job in finished:
+            if excess > 0 or now - job.finished > JOB_RESULT_TTL:
+                del self.jobs[job.id]
+                excess -= 1
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            job.status, job.started = "running", time.time()
+            try:
+                job.result = await self.handler(job)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            finally:
+                job.finished = time.time()
+                job.stage = None
+                inc("jobs_total", status=job.status)
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+                self._queue.task_done()
@@ -1,12 +1,21 @@
 import streamlit as st
-from PyPDF2 import PdfReader, errors
+from PyPDF2 import errors
 import openai
 import os
+import asyncio
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from embedding_cache import CachedEmbeddings
 import re
+from pdf_extract import extract_pages
+from index_store import sync_documents
+from index_collections import DEFAULT_COLLECTION, collection_path
+from extraction import ExtractionEngine
+from extraction_cache import ExtractionCache
+from question_splitter import split_for_extraction
+from extraction_prompt import add_usage, chunk_messages, classify_assessment, document_prompts
+from metrics import span, collect_timings, summarize
 
 # Load environment variables
 load_dotenv()
@@ -17,20 +26,15 @@ if not OPENAI_API_KEY:
     st.stop()
 
 # Function to extract text from PDF
-def get_pdf_text(pdf_docs):
-    text = ""
-    for pdf in pdf_docs:
-        try:
-            pdf_reader = PdfReader(pdf)
-            for page in pdf_reader.pages:
-                extracted_text = page.extract_text()
-                if extracted_text:
-                    text += extracted_text + "\n"
-        except errors.PdfReadError:
+# Pages are extracted in parallel across processes and joined in order once at the end
+def get_pdf_text(pdf_docs, max_workers=None):
+    documents, failures = extract_pages(pdf_docs, max_workers=max_workers)
+    for pdf, e in failures:
+        if isinstance(e, errors.PdfReadError):
             st.error(f"Error: Could not process file {pdf.name}. It may be corrupted or invalid.")
-        except Exception as e:
+        else:
             st.error(f"Unexpected error while processing {pdf.name}: {e}")
-    return text
+    return "".join(page + "\n" for _, pages in documents for page in pages if page)
 
 # Function to split text into chunks
 def get_text_chunks(text):
@@ -38,30 +42,35 @@ def get_text_chunks(text):
         st.error("No text to split.")
         st.stop()
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    return text_splitter.split_text(text)
+    with span("split"):
+        return text_splitter.split_text(text)
+
+# Function to split text for extraction: whole questions (with their suggested answers) are
+# packed into a token budget without overlap, so no question is cut in half or extracted twice
+def get_question_chunks(text):
+    if not text.strip():
+        st.error("No text to split.")
+        st.stop()
+    return split_for_extraction(text)
 
-# Function to create and store vector embeddings
-def get_vector_store(text_chunks):
+# Function to create and store vector embeddings; documents is a list of (name, text_chunks)
+# and only new or changed chunks of the collection's index are sent to the embedding API
+def get_vector_store(documents, prune=False, collection=DEFAULT_COLLECTION):
     try:
-        embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
-        vector_store = FAISS.from_texts(text_chunks, embeddings=embeddings)
-        vector_store.save_local("faiss_index")
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-ada-002"))
+        return sync_documents(documents, embeddings, collection_path(collection), prune=prune)
     except Exception as e:
         st.error(f"Error while creating vector store: {e}")
 
         import re
 
-def get_extraction_prompt(content: str):
-    """
-    Determines the type of assessment (case study or written assessment) and returns the structured extraction prompt.
-    """
-
-    is_case_study = bool(re.search(r'\bcase\s*study\b', content, re.IGNORECASE)) or "case study context" in content.lower()
-
-    assessment_type = "case_study" if is_case_study else "written_assessment"
+# Bump this whenever get_extraction_prompt changes so cached extractions from the old prompt are not reused.
+EXTRACTION_PROMPT_VERSION = "streamlit-2"
 
-    if is_case_study:
-        return f"""
+# System messages per assessment type. They never contain document text, so every chunk of a
+# document starts with the same prefix (see extraction_prompt.document_prompts on prompt caching).
+EXTRACTION_INSTRUCTIONS = {
+    "case_study": """
         You are an assistant that extracts structured information from text. 
         Extract the case study context only once if the document is for a case study assessment. 
         Then extract all the questions and suggested answers in the specified format.
@@ -86,28 +95,24 @@ def get_extraction_prompt(content: str):
         - Do not summarize or truncate answers; keep the complete answer structure.  
         
         Example output format:
-        {{
+        {
             "assessment_type": "case_study",
             "duration":<Duration>,
             "assessment_instruction":[<instructions to Candidate_point_1>, <instructions to Candidate_point_2>, ...],
             "case_study_context": "<case study content>",
             "questions_and_answers": [
-                {{
+                {
                     "question_number": <question_number>,
                     "question": "<question_text>",
                     "question_instruction": "<question_instruction>",
                     "suggested_answer": [<answer_point_1>, <answer_point_2>, ...],
                     "comparison_count":<comparison_count>,
                     "comparison_instruction":<comparison_instruction>
-                }}
+                }
             ]
-        }}
-
-        Document content:
-        {content}
-        """
-    else:
-        return f"""
+        }
+        """,
+    "written_assessment": """
         You are an assistant that extracts structured information from text. 
         Extract all the questions and suggested answers in the specified format.
 
@@ -129,50 +134,71 @@ def get_extraction_prompt(content: str):
         - Do not summarize or truncate answers; keep the complete answer structure.  
         
         Example output format:
-        {{
+        {
             "assessment_type": "written_assessment",
             "duration":<Duration>,
             "assessment_instruction":[<instructions to Candidate_point_1>, <instructions to Candidate_point_2>, ...],
             "case_study_context": "",
             "questions_and_answers": [
-                {{
+                {
                     "question_number": <question_number>,
                     "question": "<question_text>",
                     "question_instruction": "<question_instruction>",
                     "suggested_answer": [<answer_point_1>, <answer_point_2>, ...],
                     "comparison_count":<comparison_count>,
                     "comparison_instruction":<comparison_instruction>
-                }}
+                }
             ]
-        }}
+        }
+        """,
+}
 
-        Document content:
-        {content}
-        """
+def get_extraction_prompt(content: str, assessment_type: str = None):
+    """
+    Returns the extraction messages for one piece of text: the instructions for its type of assessment
+    (case study or written assessment, classified from `content` when not given), then the content itself.
+    """
+    return chunk_messages(EXTRACTION_INSTRUCTIONS[assessment_type or classify_assessment(content)], content)
+
+def get_document_prompts(text: str, chunks):
+    """
+    Prompts for every chunk of one document: the document is classified once and the case study
+    context is only extracted from the first chunk. Returns (prompts, token report).
+    """
+    return document_prompts(text, chunks, EXTRACTION_INSTRUCTIONS)
 
 
 
+
+# Extractions are cached per (model, temperature, prompt version, chunk), so re-processing
+# the same PDF returns the stored results instead of calling gpt-4-turbo again
+@st.cache_resource
+def get_extraction_cache():
+    return ExtractionCache()
+
 # Function to call OpenAI API for structured extraction
-def extract_structured_data(chunks):
-    results = []
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# prompts, when given, holds one prompt per chunk (see get_document_prompts)
+def extract_structured_data(chunks, prompts=None, report=None):
+    engine = ExtractionEngine(openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0), model="gpt-4-turbo", temperature=0.3,
+                              cache=get_extraction_cache(), prompt_version=EXTRACTION_PROMPT_VERSION)
+    results = asyncio.run(engine.extract(chunks, prompts or get_extraction_prompt))
 
-    for idx, chunk in enumerate(chunks):
-        st.write(f"Processing chunk {idx + 1}/{len(chunks)}...")
-        
-        prompt = get_extraction_prompt(chunk)
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "system", "content": prompt}],
-                temperature=0.3
-            )
-            results.append(response.choices[0].message.content)
-        except Exception as e:
-            st.error(f"Error calling OpenAI API: {e}")
-            return None
-
-    return results
+    for result in results:
+        status = "cached" if result.cached else "extracted"
+        st.write(f"Chunk {result.index + 1}/{len(chunks)}: {status if result.error is None else 'failed'}")
+
+    if report is not None:
+        add_usage(report, results)
+        st.caption(f"{report['assessment_type']}: {report['prompt_tokens']} prompt tokens "
+                   f"({report['cached_prompt_tokens']} served from the provider cache, "
+                   f"{report['note_tokens']} for case study notes), {report['completion_tokens']} completion tokens")
+
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        st.error(f"Error calling OpenAI API: {failed[0].error}")
+        return None
+
+    return [result.content for result in results]
 
 # Main function to run the app
 def main():
@@ -189,12 +215,13 @@ def main():
                 st.write(f"Total words in document: {len(raw_text.split())}")
                 
                 with st.spinner("Splitting into chunks..."):
-                    text_chunks = get_text_chunks(raw_text)
+                    text_chunks = get_question_chunks(raw_text)
+                    prompts, report = get_document_prompts(raw_text, text_chunks)
                 
                 st.write(f"Processing {len(text_chunks)} chunks...")
                 
                 with st.spinner("Extracting structured data..."):
-                    structured_output = extract_structured_data(text_chunks)
+                    structured_output = extract_structured_data(text_chunks, prompts, report)
                     
                     if structured_output:
                         st.json(structured_output)
@@ -202,5 +229,18 @@ def main():
         else:
             st.error("Please upload at least one PDF file.")
 
+    if st.button("Clear outdated cached extractions"):
+        removed = get_extraction_cache().invalidate(keep_version=EXTRACTION_PROMPT_VERSION)
+        st.success(f"Removed {removed} cached extractions from older prompt versions.")
+
+# Optional timing panel: per-stage totals for the last run that did any work
+def show_timings(timings):
+    if timings:
+        st.session_state["last_timings"] = summarize(timings)
+    if st.sidebar.checkbox("Show stage timings") and st.session_state.get("last_timings"):
+        st.sidebar.dataframe(st.session_state["last_timings"])
+
 if __name__ == "__main__":
-    main()
+    with collect_timings() as timings:
+        main()
+    show_timings(timings)
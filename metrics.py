@@ -0,0 +1,132 @@
+"""
+Per-stage latency spans and counters, exported in the Prometheus text format.
+
+    with span("faiss_search"):
+        docs = db.similarity_search(question)
+    inc("tokens_sent_total", usage["prompt_tokens"], model="gpt-4-turbo")
+
+Set METRICS_ENABLED=0 to turn everything into no-ops. collect_timings() gathers the spans
+of one request (e.g. one Streamlit run) so they can be shown in a timing panel.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+HELP = {
+    "stage_duration_seconds": "Time spent in each pipeline stage.",
+    "tokens_sent_total": "Prompt tokens sent to LLM providers.",
+    "tokens_cached_total": "Prompt tokens the provider served from its prompt cache.",
+    "tokens_received_total": "Completion tokens received from LLM providers.",
+    "chunks_processed_total": "Text chunks produced, embedded or extracted, and questions answered (stage=qa).",
+    "cache_hits_total": "Lookups answered from a cache.",
+    "cache_misses_total": "Lookups that missed a cache.",
+    "api_retries_total": "Provider calls retried after a 429, 5xx or connection error.",
+    "jobs_total": "Upload jobs by outcome: queued, rejected (queue full), done or failed.",
+    "retrievals_total": "Questions retrieved by route: lexical (no embedding call), hybrid or vector.",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # labels -> [bucket counts..., sum, count]
+_timings = contextvars.ContextVar("timings", default=None)
+_NOOP = nullcontext()
+
+
+def _labels(labels: dict):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not METRICS_ENABLED or not value:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(stage: str, seconds: float):
+    key = _labels({"stage": stage})
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def _span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def span(stage: str):
+    """Times the enclosed block as `stage`; a shared no-op when metrics are disabled."""
+    return _span(stage) if METRICS_ENABLED else _NOOP
+
+
+@contextmanager
+def collect_timings():
+    """Yields a list that receives (stage, seconds) for every span finished inside the block."""
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    if histograms:
+        name = "stage_duration_seconds"
+        lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            for bound, count in zip(BUCKETS, histogram):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def summarize(timings):
+    """Totals per stage, in first-seen order, for a timing panel."""
+    totals = {}
+    for stage, seconds in timings:
+        calls, total = totals.get(stage, (0, 0.0))
+        totals[stage] = (calls + 1, total + seconds)
+    return [{"Stage": stage, "Calls": calls, "Total ms": round(total * 1000, 1)}
+            for stage, (calls, total) in totals.items()]
@@ -0,0 +1,139 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+
+from metrics import span
+
+# Number of extraction processes. Defaults to every core; set PDF_EXTRACT_WORKERS=1
+# to fall back to the old single-process loop.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+
+# Below this many pages the process pool costs more than it saves.
+MIN_PARALLEL_PAGES = 16
+# iter_pages hands out pages in ranges of this size, at most two ranges per worker in flight.
+STREAM_PAGES_PER_TASK = 16
+
+_worker_data = None
+
+
+def read_pdf_bytes(pdf) -> bytes:
+    """The raw bytes of an uploaded file (anything with read()) or of a PDF path."""
+    if hasattr(pdf, "seek"):
+        pdf.seek(0)
+    if hasattr(pdf, "read"):
+        return pdf.read()
+    with open(pdf, "rb") as f:
+        return f.read()
+
+
+def page_count(data: bytes) -> int:
+    return len(PdfReader(BytesIO(data)).pages)
+
+
+def _extract_page_range(data: bytes, start: int, stop: int):
+    """Worker: open one PDF from raw bytes and extract pages [start, stop)."""
+    reader = PdfReader(BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _set_worker_data(*documents: bytes):
+    global _worker_data
+    _worker_data = documents
+
+
+def _extract_worker_range(start: int, stop: int, document: int = 0):
+    """Worker: like _extract_page_range, for one of the PDFs handed to the worker once at startup."""
+    return _extract_page_range(_worker_data[document], start, stop)
+
+
+def _page_ranges(page_count: int, parts: int):
+    step = max(1, -(-page_count // parts))
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def extract_pages(pdf_docs, max_workers: int = None):
+    """
+    Extracts the text of every page of every PDF, spreading the pages across a process pool.
+
+    Returns (documents, failures): documents is a list of (pdf, [page_text, ...]) in upload
+    order, failures is a list of (pdf, exception) for files that could not be read, so the
+    caller can report them the same way it always has.
+    """
+    with span("pdf_parse"):
+        return _extract_pages(pdf_docs, max_workers)
+
+
+def _extract_pages(pdf_docs, max_workers: int = None):
+    workers = max_workers or PDF_EXTRACT_WORKERS
+    documents, failures, jobs = [], [], []
+
+    for pdf in pdf_docs:
+        try:
+            data = read_pdf_bytes(pdf)
+            page_count = len(PdfReader(BytesIO(data)).pages)
+        except Exception as e:
+            failures.append((pdf, e))
+            continue
+        jobs.append((pdf, data, page_count))
+
+    total_pages = sum(page_count for _, _, page_count in jobs)
+    if workers <= 1 or total_pages < MIN_PARALLEL_PAGES:
+        for pdf, data, page_count in jobs:
+            try:
+                documents.append((pdf, _extract_page_range(data, 0, page_count)))
+            except Exception as e:
+                failures.append((pdf, e))
+        return documents, failures
+
+    # Every worker gets the PDFs once at startup; the tasks only name a document and page range.
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_data,
+                             initargs=tuple(data for _, data, _ in jobs)) as pool:
+        pending = []
+        for document, (pdf, _, page_count) in enumerate(jobs):
+            # A few ranges per worker keeps the pool busy when page costs are uneven.
+            parts = max(1, min(page_count, workers * 2 * page_count // total_pages))
+            futures = [pool.submit(_extract_worker_range, start, stop, document)
+                       for start, stop in _page_ranges(page_count, parts)]
+            pending.append((pdf, futures))
+
+        for pdf, futures in pending:
+            try:
+                pages = []
+                for future in futures:
+                    pages.extend(future.result())
+                documents.append((pdf, pages))
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                failures.append((pdf, e))
+
+    return documents, failures
+
+
+def iter_pages(data: bytes, start: int = 0, max_workers: int = None):
+    """
+    Yields the text of each page of one PDF, in order, from page `start` on.
+
+    Unlike extract_pages, only a few page ranges are extracted ahead of the consumer, so
+    memory stays flat however long the document is. The PDF is sent to each worker once.
+    """
+    workers = max_workers or PDF_EXTRACT_WORKERS
+    total = page_count(data)
+    if workers <= 1 or total - start < MIN_PARALLEL_PAGES:
+        reader = PdfReader(BytesIO(data))
+        for i in range(start, total):
+            yield reader.pages[i].extract_text() or ""
+        return
+
+    ranges = ((i, min(i + STREAM_PAGES_PER_TASK, total)) for i in range(start, total, STREAM_PAGES_PER_TASK))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_data, initargs=(data,)) as pool:
+        pending = deque(pool.submit(_extract_worker_range, *r) for _, r in zip(range(workers * 2), ranges))
+        while pending:
+            pages = pending.popleft().result()
+            following = next(ranges, None)
+            if following is not None:
+                pending.append(pool.submit(_extract_worker_range, *following))
+            yield from pages
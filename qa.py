@@ -0,0 +1,90 @@
+import asyncio
+import os
+import time
+
+import faiss
+import numpy as np
+
+from embedding_cache import embed_query_batch
+from metrics import span
+
+QA_CONCURRENCY = int(os.getenv("QA_CONCURRENCY", "8"))
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def batch_similarity_search(vector_store, query_vectors, k: int = 4):
+    """Runs one FAISS search for the whole query matrix and returns the top-k documents per query."""
+    matrix = np.asarray(query_vectors, dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        faiss.normalize_L2(matrix)
+    with span("faiss_search"):
+        _, positions = vector_store.index.search(matrix, k)
+    results = []
+    for row in positions:
+        docs = []
+        for pos in row:
+            if pos == -1:
+                continue
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+            if not isinstance(doc, str):
+                docs.append(doc)
+        results.append(docs)
+    return results
+
+
+async def answer_questions(questions, vector_store, answer_fn, k: int = 4, concurrency: int = None,
+                           answer_cache=None, index_version=None):
+    """
+    Answers many questions against one index.
+
+    All questions are embedded with batched requests, retrieved with a single matrix search,
+    and `answer_fn(question, docs)` (a coroutine returning the answer text) is fanned out
+    with at most `concurrency` calls in flight. A failed question carries an "error" entry
+    and does not affect the others. With an `answer_cache` (a SemanticAnswerCache),
+    near-duplicates of questions already answered on `index_version` skip the LLM call.
+    """
+    started = time.perf_counter()
+    embeddings = vector_store.embedding_function
+    # Embedding and search are blocking; keep them off the event loop.
+    vectors = await asyncio.to_thread(embed_query_batch, embeddings, questions)
+    embedded = time.perf_counter()
+    retrieved_docs = await asyncio.to_thread(batch_similarity_search, vector_store, vectors, k)
+    searched = time.perf_counter()
+
+    semaphore = asyncio.Semaphore(concurrency or QA_CONCURRENCY)
+
+    async def answer(question, vector, docs):
+        entry = {"question": question, "sources": [doc.metadata.get("source") for doc in docs]}
+        if answer_cache is not None:
+            cached = answer_cache.get(vector, index_version, question)
+            if cached is not None:
+                entry.update(answer=cached[1], cached=True,
+                             timings={"llm_ms": 0.0, "total_ms": _ms(time.perf_counter() - started)})
+                return entry
+        async with semaphore:
+            llm_started = time.perf_counter()
+            try:
+                with span("llm"):
+                    entry["answer"] = await answer_fn(question, docs)
+                if answer_cache is not None:
+                    answer_cache.put(vector, index_version, question, entry["answer"])
+            except Exception as e:
+                entry["answer"] = None
+                entry["error"] = str(e)
+            entry["timings"] = {"llm_ms": _ms(time.perf_counter() - llm_started),
+                                "total_ms": _ms(time.perf_counter() - started)}
+        return entry
+
+    answers = await asyncio.gather(*(answer(q, vector, docs)
+                                     for q, vector, docs in zip(questions, vectors, retrieved_docs)))
+    return {
+        "answers": answers,
+        "timings": {
+            "embed_ms": _ms(embedded - started),
+            "search_ms": _ms(searched - embedded),
+            "total_ms": _ms(time.perf_counter() - started),
+        },
+    }
@@ -0,0 +1,125 @@
+import os
+import re
+from functools import lru_cache
+
+from metrics import inc, span
+
+EXTRACTION_CHUNK_TOKENS = int(os.getenv("EXTRACTION_CHUNK_TOKENS", "3000"))
+
+# "Question 3", "Question No. 3", "Q3", "Q.3", "Q 3:", "WA3(Spend approx...)", "Question3What..." at the start of a line.
+# The short Q form needs ".", ":", ")" or the end of the line after the number, so that lines
+# like "Q3 results were driven by..." are not taken for headings.
+QUESTION_HEADING = re.compile(
+    r"^\s*(?:question\s*(?:no\.?|number)?|wa|q(?=\s*\.?\s*\d{1,3}\s*(?:[.:)]|$)))\s*\.?\s*(\d{1,3})(?!\d)",
+    re.IGNORECASE,
+)
+# "3." / "3)" at the start of a line, only used when the document has no explicit question headings
+NUMBERED_LINE = re.compile(r"^\s*(\d{1,3})\s*[.)]\s+\S")
+# "Suggested answer", "Suggested Answers (any 2):", "SuggestedAnswers(Any2):"
+ANSWER_HEADING = re.compile(r"^\s*suggested\s*answers?\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def token_counter(model: str = "gpt-4-turbo"):
+    encoding = _encoding(model)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def split_questions(text: str):
+    """
+    Splits an assessment into [preamble, question 1, question 2, ...], each question keeping
+    its "Suggested answer" section. Explicit "Question N" / "QN" headings are used when the
+    document has them; otherwise numbered lines ("N." / "N)") start a question only when N is
+    the next expected question number and the line is not inside a suggested-answer list
+    that is still counting up from 1.
+    """
+    lines = text.splitlines(keepends=True)
+    explicit = any(QUESTION_HEADING.match(line) for line in lines)
+
+    segments, current = [], []
+    expected = 1
+    in_answer = False
+    answer_points = 0
+    for line in lines:
+        starts_question = False
+        if explicit:
+            starts_question = QUESTION_HEADING.match(line) is not None
+        else:
+            match = NUMBERED_LINE.match(line)
+            if match:
+                number = int(match.group(1))
+                if in_answer and number == answer_points + 1:
+                    answer_points = number
+                elif number == expected:
+                    starts_question = True
+        if starts_question:
+            segments.append("".join(current))
+            current = []
+            expected += 1
+            in_answer = False
+            answer_points = 0
+        elif ANSWER_HEADING.match(line):
+            in_answer = True
+            answer_points = 0
+        current.append(line)
+    segments.append("".join(current))
+    # The first segment is whatever precedes the first question (duration, instructions, context).
+    return [segments[0]] + [segment for segment in segments[1:] if segment.strip()]
+
+
+SEPARATORS = ("\n\n", "\n", " ")
+
+
+def _split_oversized(text: str, budget: int, count, separators=SEPARATORS):
+    """Breaks one piece of text that is over budget at paragraph, then line, then word boundaries."""
+    for i, separator in enumerate(separators):
+        parts = text.split(separator)
+        if len(parts) > 1:
+            pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+            return _pack([piece for piece in pieces if piece], budget, count, separators[i + 1:])
+    # A single unbreakable token run: cut by characters in proportion to its size.
+    size = max(1, len(text) * budget // max(count(text), 1))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _pack(pieces, budget: int, count, separators=SEPARATORS):
+    chunks, current, used = [], "", 0
+    for piece in pieces:
+        cost = count(piece)
+        if cost > budget:
+            if current:
+                chunks.append(current)
+                current, used = "", 0
+            chunks.extend(_split_oversized(piece, budget, count, separators))
+            continue
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = "", 0
+        current += piece
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_for_extraction(text: str, max_tokens: int = None, count_tokens=None):
+    """
+    Packs whole questions (question text plus suggested answer) into chunks of at most
+    `max_tokens` tokens, in document order and with no overlap. A question that is larger
+    than the budget on its own is split at paragraph, line or word boundaries.
+    """
+    budget = max_tokens or EXTRACTION_CHUNK_TOKENS
+    count = count_tokens or token_counter()
+    with span("split"):
+        pieces = [segment for segment in split_questions(text) if segment.strip()]
+        chunks = [chunk for chunk in _pack(pieces, budget, count) if chunk.strip()]
+    inc("chunks_processed_total", len(chunks), stage="split")
+    return chunks
@@ -0,0 +1,83 @@
+import os
+import re
+
+from metrics import inc, span
+
+# vector: embed the question and search FAISS (one embedding API call per question).
+# lexical: BM25 over chunks.sqlite only, no API call.
+# hybrid: BM25 first; only when it has no confident match is the question embedded, and the
+#   FAISS and BM25 results are then merged.
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+# Hybrid trusts BM25 alone when its best chunk contains every term of the question and scores
+# at least this many times the next best chunk.
+LEXICAL_MIN_MARGIN = float(os.getenv("LEXICAL_MIN_MARGIN", "1.5"))
+RRF_K = 60
+
+STOPWORDS = frozenset("""
+a about an and any are as at be by can could describe did do does explain for from give how i in is it
+its list me of on or outline please should tell that the their them there these this those to was
+what when where which who whom why will with would you your
+""".split())
+
+
+def query_terms(question: str):
+    """Lower-cased words of the question without stopwords, in order and without repeats."""
+    terms = []
+    for word in re.findall(r"\w+", question.lower()):
+        if word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+
+def _merge(result_lists, k: int):
+    """Reciprocal rank fusion of several ranked Document lists."""
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.id or doc.page_content
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+
+def _confident(docstore, terms, scored) -> bool:
+    """True when the top BM25 hit has every term and clearly beats the runner-up."""
+    if not scored:
+        return False
+    best = docstore.lexical_search(terms, 1, match_all=True)
+    if not best or best[0][0].id != scored[0][0].id:
+        return False
+    return len(scored) == 1 or scored[0][1] >= LEXICAL_MIN_MARGIN * scored[1][1]
+
+
+def retrieve(vector_store, question: str, k: int = 4, mode: str = None):
+    """
+    Returns (docs, question_vector) for `question`. question_vector is None when the
+    question was answered from the lexical index without calling the embedding model.
+    """
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {', '.join(RETRIEVAL_MODES)}.")
+    docstore = vector_store.docstore
+    lexical = mode != "vector" and hasattr(docstore, "lexical_search")
+
+    if lexical:
+        terms = query_terms(question)
+        with span("lexical_search"):
+            # At least two hits, to compare the best with the runner-up.
+            scored = docstore.lexical_search(terms, max(k, 2))
+            ranked = [doc for doc, _ in scored[:k]]
+            confident = mode == "hybrid" and _confident(docstore, terms, scored)
+        if mode == "lexical" or confident:
+            inc("retrievals_total", route="lexical")
+            return ranked, None
+
+    question_vector = vector_store.embedding_function.embed_query(question)
+    with span("faiss_search"):
+        docs = vector_store.similarity_search_by_vector(question_vector, k=k)
+    if lexical:
+        inc("retrievals_total", route="hybrid")
+        return _merge([docs, ranked], k), question_vector
+    inc("retrievals_total", route="vector")
+    return docs, question_vector
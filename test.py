@@ -1,12 +1,29 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
 from PyPDF2 import PdfReader , errors
 import openai
 import os 
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+from embedding_cache import CachedEmbeddings
+from extraction import ExtractionEngine
+from extraction_cache import ExtractionCache
+from index_store import load_manifest, sync_documents
+from pdf_extract import extract_pages
+from jobs import Job, JobQueue, QueueFull, JOB_WORKERS
+from index_collections import IndexCache, DEFAULT_COLLECTION, collection_exists, collection_path, list_collections
+from qa import answer_questions
+from question_splitter import split_for_extraction
+from extraction_prompt import add_usage, chunk_messages, classify_assessment, document_prompts
+from metrics import span, render_prometheus
+from answer_cache import SemanticAnswerCache
 from langchain_community.vectorstores import FAISS
 import re
+import json
+import asyncio
+import threading
 from typing import List
 import uvicorn
 
@@ -27,7 +44,15 @@ def get_text_chunks(text:str):
     if not text.strip():
         raise HTTPException(status_code =400, detail = "No text to split.")
     text_splitter = RecursiveCharacterTextSplitter(chunk_size = 10000, chunk_overlap =1000)
-    return text_splitter.split_text(text)
+    with span("split"):
+        return text_splitter.split_text(text)
+
+# Extraction chunks keep each question together with its suggested answer, are packed up to a
+# token budget and do not overlap, so no question is sent to the LLM twice or cut in half.
+def get_question_chunks(text:str):
+    if not text.strip():
+        raise HTTPException(status_code =400, detail = "No text to split.")
+    return split_for_extraction(text)
 
 #---------------------------------------------------------------------------------------------------------
 #                                  Vector store
@@ -35,7 +60,7 @@ def get_text_chunks(text:str):
 
 def get_vector_store(text_chunks):
     try:
-        embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-ada-002"))
         vector_store = FAISS.from_texts(text_chunks,embedding=embeddings)
     except Exception as e:
         raise HTTPException(status_code =500, detail = f'Error while create vector store:{e}')
@@ -47,17 +72,13 @@ def get_vector_store(text_chunks):
 
 import re 
 
-def get_extraction_prompt(content: str):
-    """
-    Determines the type of assessment (case study or written assessment) and returns the structured extraction prompt.
-    """
-
-    is_case_study = bool(re.search(r'\bcase\s*study\b', content, re.IGNORECASE)) or "case study context" in content.lower()
+# Bump this whenever get_extraction_prompt changes so cached extractions from the old prompt are not reused.
+EXTRACTION_PROMPT_VERSION = "api-2"
 
-    assessment_type = "case_study" if is_case_study else "written_assessment"
-
-    if is_case_study:
-        return f"""
+# System messages per assessment type. They never contain document text, so every chunk of a
+# document starts with the same prefix (see extraction_prompt.document_prompts on prompt caching).
+EXTRACTION_INSTRUCTIONS = {
+    "case_study": """
         You are an assistant that extracts structured information from text. 
         Extract the case study context only once if the document is for a case study assessment. 
         Then extract all the questions and suggested answers in the specified format.
@@ -81,28 +102,24 @@ def get_extraction_prompt(content: str):
         - If a question contains multiple parts (e.g., sub-questions or steps), extract **each part completely** and structure it appropriately.  
 
         Example output format:
-        {{
+        {
             "assessment_type": "case_study",
             "duration": <Duration>,
             "assessment_instruction": [<instructions_to_candidate_point_1>, <instructions_to_candidate_point_2>, ...],
             "case_study_context": "<case study content>",
             "questions_and_answers": [
-                {{
+                {
                     "question_number": <question_number>,
                     "question": "<full_question_text>",
                     "question_instruction": "<question_instruction>",
                     "suggested_answer": [<answer_point_1>, <answer_point_2>, ...],
                     "comparison_count": <comparison_count>,
                     "comparison_instruction": <comparison_instruction>
-                }}
+                }
             ]
-        }}
-
-        Document content:
-        {content}
-        """
-    else:
-        return f"""
+        }
+        """,
+    "written_assessment": """
         You are an assistant that extracts structured information from text. 
         Extract all the questions and suggested answers in the specified format.
 
@@ -123,52 +140,67 @@ def get_extraction_prompt(content: str):
         - If a question has multiple parts (e.g., step-by-step breakdowns or sub-questions), extract **each part completely** and maintain its structure.  
 
         Example output format:
-        {{
+        {
             "assessment_type": "written_assessment",
             "duration": <Duration>,
             "assessment_instruction": [<instructions_to_candidate_point_1>, <instructions_to_candidate_point_2>, ...],
             "case_study_context": "",
             "questions_and_answers": [
-                {{
+                {
                     "question_number": <question_number>,
                     "question": "<full_question_text>",
                     "question_instruction": "<question_instruction>",
                     "suggested_answer": [<answer_point_1>, <answer_point_2>, ...],
                     "comparison_count": <comparison_count>,
                     "comparison_instruction": <comparison_instruction>
-                }}
+                }
             ]
-        }}
+        }
+        """,
+}
+
+def get_extraction_prompt(content: str, assessment_type: str = None):
+    """
+    Returns the extraction messages for one piece of text: the instructions for its type of assessment
+    (case study or written assessment, classified from `content` when not given), then the content itself.
+    """
+    return chunk_messages(EXTRACTION_INSTRUCTIONS[assessment_type or classify_assessment(content)], content)
+
+def get_document_prompts(text: str, chunks):
+    """
+    Prompts for every chunk of one document: the document is classified once and the case study
+    context is only extracted from the first chunk. Returns (prompts, token report).
+    """
+    return document_prompts(text, chunks, EXTRACTION_INSTRUCTIONS)
 
-        Document content:
-        {content}
-        """
 
 #---------------------------------------------------------------------------------------------------------
 #                                Extract function 
 #---------------------------------------------------------------------------------------------------------
-def extract_structured_data(chunks):
-    results = []
-    openai.api_key = OPENAI_API_KEY  # Correct way to set API key
+# Chunks are sent concurrently through a shared engine that enforces the OpenAI rate limits
+# and retries 429/5xx responses per chunk; results come back in chunk order.
+# Chunks already extracted with the current prompt version are served from the extraction cache.
+_extraction_engine = None
+extraction_cache = ExtractionCache()
+
+def get_extraction_engine():
+    global _extraction_engine
+    if _extraction_engine is None:
+        # ExtractionEngine does the retrying, so the SDK's own retries are turned off.
+        client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        _extraction_engine = ExtractionEngine(client, model="gpt-4-turbo", temperature=0.0,
+                                              cache=extraction_cache, prompt_version=EXTRACTION_PROMPT_VERSION)
+    return _extraction_engine
+
+
+async def extract_structured_data(chunks, prompts=None):
+    results = await get_extraction_engine().extract(chunks, prompts or get_extraction_prompt)
+
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        detail = "; ".join(f"chunk {result.index + 1}: {result.error}" for result in failed)
+        raise HTTPException(status_code=500, detail=f"Error calling OpenAI API: {detail}")
 
-    for idx, chunk in enumerate(chunks):
-        try:
-            prompt = get_extraction_prompt(chunk)  # Fix: Use a single chunk
-            
-            response = openai.ChatCompletion.create(  # Fix: Correct API call
-                model="gpt-4-turbo",
-                messages=[{"role": "system", "content": prompt}],
-                temperature=0.0
-            )
-
-            if not response.choices:  # Fix: Handle empty response case
-                raise HTTPException(status_code=500, detail="OpenAI API did not return choices.")
-
-            results.append(response.choices[0].message["content"])  # Fix: Correct key access
-
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error calling OpenAI API: {e}")
-    
     return results
 
 
@@ -179,9 +211,271 @@ def extract_structured_data(chunks):
 
 @app.post("/process_pdf")
 async def process_pdf(content:str = Form(...)):
-    text_chunks = get_text_chunks(content)
-    structured_output = extract_structured_data(text_chunks)
-    return { "structured_data":structured_output}
+    # Token counting over the whole document is CPU-bound, so it runs off the event loop.
+    text_chunks = await asyncio.to_thread(get_question_chunks, content)
+    prompts, report = await asyncio.to_thread(get_document_prompts, content, text_chunks)
+    results = await extract_structured_data(text_chunks, prompts)
+    return {
+        "structured_data": [result.content for result in results],
+        "cache_status": ["hit" if result.cached else "miss" for result in results],
+        "prompt_report": add_usage(report, results),
+    }
+
+
+@app.post("/process_pdf/stream")
+async def process_pdf_stream(content:str = Form(...), format:str = "ndjson"):
+    """
+    Same extraction as /process_pdf, but each chunk's result is sent as soon as it is ready
+    (in completion order, tagged with chunk_index) as NDJSON lines or, with format=sse,
+    as server-sent events. The last message has "done": true.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'.")
+    # Token counting over the whole document is CPU-bound, so it runs off the event loop.
+    text_chunks = await asyncio.to_thread(get_question_chunks, content)
+    prompts, report = await asyncio.to_thread(get_document_prompts, content, text_chunks)
+
+    def encode(message):
+        line = json.dumps(message)
+        return f"data: {line}\n\n" if format == "sse" else line + "\n"
+
+    async def events():
+        failed = 0
+        results = []
+        async for result in get_extraction_engine().iter_extract(text_chunks, prompts):
+            results.append(result)
+            message = {"chunk_index": result.index, "total_chunks": len(text_chunks)}
+            if result.error is not None:
+                failed += 1
+                message.update(status="error", error=f"Error calling OpenAI API: {result.error}")
+            else:
+                message.update(status="hit" if result.cached else "miss", structured_data=result.content)
+            yield encode(message)
+        yield encode({"done": True, "total_chunks": len(text_chunks), "failed_chunks": failed,
+                      "prompt_report": add_usage(report, results)})
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+
+@app.delete("/extraction_cache")
+async def clear_extraction_cache(prompt_version: str = None, stale_only: bool = False):
+    """Drops cached extractions: one prompt version, every version but the current one, or all of them."""
+    if stale_only:
+        removed = extraction_cache.invalidate(keep_version=EXTRACTION_PROMPT_VERSION)
+    else:
+        removed = extraction_cache.invalidate(prompt_version=prompt_version)
+    return {"removed": removed}
+
+
+#--------------------------------------------------------------------------------------------------------------
+#                                 Batch question answering
+#--------------------------------------------------------------------------------------------------------------
+
+QA_PROMPT = """
+    Answer the question as detailed as possible from the provided context. If the answer is not in
+    the provided context, say, "answer is not available in the context". Don't provide incorrect answers.
+
+    Context:\n {context}\n
+    Question: {question}\n
+    Answer:
+    """
+
+qa_embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-ada-002"))
+# Loaded collection indexes, least recently used unloaded first; one answer cache per collection
+qa_indexes = IndexCache(qa_embeddings)
+qa_answer_caches = {}
+
+
+class BatchQuestions(BaseModel):
+    questions: List[str]
+    k: int = 4
+    collection: str = DEFAULT_COLLECTION
+
+
+class Question(BaseModel):
+    question: str
+    k: int = 4
+
+
+# Answers share the extraction engine's rate limit and retries, so a large batch of questions
+# cannot use up the budget extraction depends on, and a 429 is retried instead of failing.
+async def answer_with_openai(question, docs):
+    context = "\n\n".join(doc.page_content for doc in docs)
+    prompt = [{"role": "user", "content": QA_PROMPT.format(context=context, question=question)}]
+    result = await get_extraction_engine().extract_one(0, prompt, temperature=0.3, stage="qa")
+    if result.error is not None:
+        raise result.error
+    return result.content
+
+
+def load_collection(collection: str):
+    """
+    The collection's IndexHandle and loaded vector store, or the HTTP error explaining why it
+    can't be used. A cold load reads the whole index, so async routes call this in a thread.
+    """
+    try:
+        path = collection_path(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not collection_exists(collection):
+        raise HTTPException(status_code=404, detail=f"Collection {collection!r} has no index.")
+    manifest = load_manifest(path)
+    if manifest is not None and manifest["embedding_model"] != qa_embeddings.model:
+        raise HTTPException(status_code=409, detail=f"Collection {collection!r} was built with "
+                                                    f"{manifest['embedding_model']}, not {qa_embeddings.model}.")
+    handle = qa_indexes.get(collection)
+    try:
+        return handle, handle.get()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error while loading vector store: {e}")
+
+
+@app.post("/qa/batch")
+async def qa_batch(request: BatchQuestions):
+    """Answers every question against one collection with one embedding batch, one FAISS search and concurrent LLM calls."""
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given.")
+    handle, vector_store = await asyncio.to_thread(load_collection, request.collection)
+    return await answer_questions(request.questions, vector_store, answer_with_openai, k=request.k,
+                                  answer_cache=qa_answer_caches.setdefault(request.collection, SemanticAnswerCache()),
+                                  index_version=handle.version)
+
+
+@app.get("/collections")
+async def get_collections():
+    return {"collections": list_collections(), "loaded": qa_indexes.loaded()}
+
+
+@app.post("/collections/{collection}/query")
+async def query_collection(collection: str, request: Question):
+    """Answers one question against the named collection's index."""
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="No question given.")
+    handle, vector_store = await asyncio.to_thread(load_collection, collection)
+    result = await answer_questions([request.question], vector_store, answer_with_openai, k=request.k,
+                                    answer_cache=qa_answer_caches.setdefault(collection, SemanticAnswerCache()),
+                                    index_version=handle.version)
+    answer = result["answers"][0]
+    if answer.get("error"):
+        raise HTTPException(status_code=500, detail=f"Error calling OpenAI API: {answer['error']}")
+    return {"collection": collection, **answer}
+
+
+#--------------------------------------------------------------------------------------------------------------
+#                                 Upload jobs
+#--------------------------------------------------------------------------------------------------------------
+# Uploaded PDFs are spooled to disk and processed by a fixed pool of workers: text extraction,
+# structured extraction, and embedding into a collection. The request returns as soon as the
+# file is queued; clients poll GET /jobs/{job_id} and fetch GET /jobs/{job_id}/result.
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Each job's PDF parsing gets its share of the cores, so concurrent jobs don't oversubscribe them.
+JOB_PDF_WORKERS = max(1, (os.cpu_count() or 1) // JOB_WORKERS)
+# Jobs for the same collection update its index one at a time.
+collection_locks = {}
+
+
+def sync_collection(collection: str, documents):
+    with collection_locks.setdefault(collection, threading.Lock()):
+        return sync_documents(documents, qa_embeddings, collection_path(collection))
+
+
+async def process_job(job: Job):
+    job.stage = "pdf_parse"
+    documents, failures = await asyncio.to_thread(extract_pages, [job.path], JOB_PDF_WORKERS)
+    if failures:
+        raise HTTPException(status_code=422, detail=f"Could not process file {job.filename}: {failures[0][1]}")
+    pages = documents[0][1]
+    text = "".join(pages)
+
+    job.stage = "extraction"
+    # Splitting and token counting are CPU-bound; off the event loop, other requests keep being served.
+    question_chunks = await asyncio.to_thread(get_question_chunks, text)
+    prompts, report = await asyncio.to_thread(get_document_prompts, text, question_chunks)
+    results = await extract_structured_data(question_chunks, prompts)
+
+    index_stats = None
+    if job.params.get("collection"):
+        job.stage = "embedding"
+        chunks = await asyncio.to_thread(get_text_chunks, text)
+        index_stats = await asyncio.to_thread(sync_collection, job.params["collection"], [(job.filename, chunks)])
+    return {
+        "pages": len(pages),
+        "structured_data": [result.content for result in results],
+        "cache_status": ["hit" if result.cached else "miss" for result in results],
+        "prompt_report": add_usage(report, results),
+        "index": index_stats,
+    }
+
+
+job_queue = JobQueue(process_job)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_queue.start()
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), collection: str = Form(None)):
+    """Spools the uploaded PDF to disk and queues it; returns 429 when the queue is full."""
+    if collection:
+        try:
+            collection_path(collection)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    job = job_queue.new_job(file.filename or "upload.pdf", {"collection": collection})
+    size = 0
+    try:
+        with open(job.path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload is larger than {MAX_UPLOAD_BYTES} bytes.")
+                out.write(chunk)
+        with open(job.path, "rb") as f:
+            if f.read(5) != b"%PDF-":
+                raise HTTPException(status_code=400, detail=f"{job.filename} is not a PDF file.")
+        position = job_queue.submit(job)
+    except QueueFull as e:
+        os.remove(job.path)
+        raise HTTPException(status_code=429, detail=f"Too many pending jobs: {e}", headers={"Retry-After": "30"})
+    except HTTPException:
+        os.remove(job.path)
+        raise
+    return {"job_id": job.id, "status": job.status, "queue_position": position}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return {**job.summary(), "queue_depth": job_queue.depth()}
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}.")
+    return {"job_id": job.id, **job.result}
+
+
+#--------------------------------------------------------------------------------------------------------------
+#                                 Metrics
+#--------------------------------------------------------------------------------------------------------------
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latency histograms and token/chunk/cache/retry counters in the Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 
 #--------------------------------------------------------------------------------------------------------------
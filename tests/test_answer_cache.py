@@ -0,0 +1,17 @@
+from answer_cache import SemanticAnswerCache
+
+
+def test_hit_needs_the_same_numbers():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put([1.0, 0.0], "v1", "Explain question 3", "answer 3")
+    near = [0.99, 0.05]
+    assert cache.get(near, "v1", "Explain question 4") is None
+    assert cache.get(near, "v1", "Please explain question 3") == ("Explain question 3", "answer 3")
+
+
+def test_best_match_with_the_same_numbers_wins():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put([1.0, 0.0], "v1", "Explain question 3", "answer 3")
+    cache.put([0.95, 0.1], "v1", "Explain question 4", "answer 4")
+    assert cache.get([1.0, 0.0], "v1", "Explain question 4") == ("Explain question 4", "answer 4")
+    assert cache.get([1.0, 0.0], "v2", "Explain question 4") is None
@@ -0,0 +1,28 @@
+import shutil
+
+from langchain_community.embeddings import FakeEmbeddings
+
+from index_store import LEGACY_DOCUMENT, open_index, sync_documents
+
+
+def test_index_without_manifest_is_kept(tmp_path):
+    # The shipped faiss_index predates manifests (index.faiss + index.pkl only).
+    path = str(tmp_path / "faiss_index")
+    shutil.copytree("faiss_index", path)
+    embeddings = FakeEmbeddings(size=1536)
+    vector_store, manifest = open_index(path, embeddings)
+    before = vector_store.index.ntotal
+    vector_store.docstore.close()
+    assert manifest["documents"][LEGACY_DOCUMENT]["ids"]
+
+    stats = sync_documents([("new.pdf", ["first chunk", "second chunk"])], embeddings, path)
+    vector_store, manifest = open_index(path, embeddings)
+    assert stats["added"] == 2 and stats["deleted"] == 0
+    assert vector_store.index.ntotal == before + 2
+    assert set(manifest["documents"]) == {LEGACY_DOCUMENT, "new.pdf"}
+    vector_store.docstore.close()
+
+    sync_documents([("new.pdf", ["first chunk"])], embeddings, path, prune=True)
+    vector_store, manifest = open_index(path, embeddings)
+    assert vector_store.index.ntotal == 1 and set(manifest["documents"]) == {"new.pdf"}
+    vector_store.docstore.close()
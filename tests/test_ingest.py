@@ -0,0 +1,43 @@
+import gc
+
+import pytest
+from langchain_community.embeddings import FakeEmbeddings
+
+import ingest
+from bench.synthetic_pdf import write_pdf
+from index_store import open_index
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    write_pdf(str(tmp_path / "e.pdf"), 12)
+    write_pdf(str(tmp_path / "f.pdf"), 6, doc=1)
+    return tmp_path
+
+
+def test_ingest_after_an_interrupted_one(pdfs, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_BATCH_CHUNKS", 1)
+    embeddings = FakeEmbeddings(size=8)
+    path = str(pdfs / "index")
+    # Chunks from the first ingest are written before it fails; without an explicit rollback
+    # its connection keeps the write lock until garbage collection, which is off here.
+    ingest.ingest_pdf(str(pdfs / "f.pdf"), "f.pdf", embeddings, path, max_workers=1, chunk_size=500, chunk_overlap=50)
+
+    def interrupt(pages_done, total_pages, chunks_done):
+        if pages_done == 6:
+            raise KeyboardInterrupt
+
+    gc.disable()
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            ingest.ingest_pdf(str(pdfs / "e.pdf"), "e.pdf", embeddings, path, progress=interrupt, max_workers=1,
+                              chunk_size=500, chunk_overlap=50)
+        stats = ingest.ingest_pdf(str(pdfs / "f.pdf"), "g.pdf", embeddings, path, max_workers=1,
+                                  chunk_size=500, chunk_overlap=50)
+    finally:
+        gc.enable()
+
+    vector_store, manifest = open_index(path, embeddings)
+    assert set(manifest["documents"]) == {"f.pdf", "g.pdf"}
+    assert vector_store.index.ntotal == 2 * stats["chunks"]
+    vector_store.docstore.close()
@@ -0,0 +1,32 @@
+from question_splitter import ANSWER_HEADING, QUESTION_HEADING, split_questions
+
+
+def test_question_headings():
+    for line in ["Question 3", "Question No. 3", "Q3", "Q3\n", "Q.3", "Q 3:", "Q3) Explain", "WA1(Spend approx. 10 minutes)",
+                 "Question1What is a budget?", "wa 2 Describe"]:
+        assert QUESTION_HEADING.match(line), line
+    for line in ["Question 1234", "Was 3 enough?", "Quarter 3", "Q3 results were driven by costs",
+                 "Q1 revenue was 5m"]:
+        assert not QUESTION_HEADING.match(line), line
+
+
+def test_answer_headings():
+    for line in ["Suggested answer", "Suggested Answers (any 2):", "SuggestedAnswers(Any2):"]:
+        assert ANSWER_HEADING.match(line), line
+
+
+def test_split_keeps_suggested_answers_with_their_question():
+    text = ("Duration: 1 hour\n"
+            "WA1(Spend approx. 10 minutes)\nList two risks.\nSuggestedAnswers(Any2):\n1. Fire\n2. Flood\n"
+            "WA2(Spend approx. 5 minutes)\nName a control.\nSuggested answer\nA fence\n")
+    preamble, first, second = split_questions(text)
+    assert preamble == "Duration: 1 hour\n"
+    assert first.startswith("WA1") and "2. Flood" in first
+    assert second.startswith("WA2") and second.endswith("A fence\n")
+
+
+def test_quarter_in_an_answer_does_not_split_it_off():
+    text = ("Question 1\nHow did the company do?\nSuggested answer\nRevenue grew.\n"
+            "Q3 results were driven by costs.\nQuestion 2\nWhat next?\n")
+    preamble, first, second = split_questions(text)
+    assert "Q3 results" in first and second.startswith("Question 2")
@@ -0,0 +1,47 @@
+import pytest
+from langchain_community.embeddings import FakeEmbeddings
+
+import retrieval
+from chunk_store import empty_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    embeddings = FakeEmbeddings(size=8)
+    texts = [
+        "Mitochondria are the powerhouse of the cell. Mitochondria make ATP.",
+        "The cell membrane controls what enters the cell.",
+        "Inflation is a general rise in prices.",
+        "Question 3 asks about inflation and interest rates.",
+        "Question 4 asks about inflation targets.",
+    ]
+    vector_store = empty_store(str(tmp_path), embeddings, 8)
+    vector_store.add_texts(texts, ids=[f"c{i}" for i in range(len(texts))])
+    return vector_store
+
+
+def embed_calls(monkeypatch, vector_store):
+    calls = []
+    real = vector_store.embedding_function.embed_query
+    monkeypatch.setattr(vector_store.embedding_function.__class__, "embed_query",
+                        lambda self, text: calls.append(text) or real(text))
+    return calls
+
+
+def test_clear_lexical_winner_skips_the_embedding(store, monkeypatch):
+    calls = embed_calls(monkeypatch, store)
+    docs, vector = retrieval.retrieve(store, "What do mitochondria do?", k=2, mode="hybrid")
+    assert vector is None and not calls
+    assert docs[0].id == "c0"
+
+
+def test_close_lexical_scores_fall_back_to_vectors(store, monkeypatch):
+    calls = embed_calls(monkeypatch, store)
+    docs, vector = retrieval.retrieve(store, "Explain inflation", k=2, mode="hybrid")
+    assert vector is not None and calls == ["Explain inflation"]
+
+
+def test_top_hit_without_every_term_is_not_trusted(store, monkeypatch):
+    calls = embed_calls(monkeypatch, store)
+    retrieval.retrieve(store, "mitochondria inflation", k=2, mode="hybrid")
+    assert calls
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from app import get_text_chunks
+from ingest import StreamingSplitter
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa".split()
+
+
+def random_page(rng):
+    paragraphs = []
+    for _ in range(rng.randint(1, 12)):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))) for _ in range(rng.randint(1, 8))]
+        paragraphs.append("\n".join(lines))
+    page = rng.choice(["\n\n", "\n", "\n\n\n", " "]).join(paragraphs)
+    return page + rng.choice(["", "\n", "\n\n", " "])
+
+
+def random_pages(rng):
+    pages = [random_page(rng) for _ in range(rng.randint(1, 60))]
+    kind = rng.randrange(4)
+    if kind == 1:
+        # Some documents have no blank lines at all, so the whole text is split by line.
+        pages = [page.replace("\n\n", "\n") for page in pages]
+    elif kind == 2:
+        # Or no line breaks: the splitter falls back to spaces.
+        pages = [page.replace("\n", " ") for page in pages]
+    elif kind == 3:
+        # A long run without any separator is split by character.
+        pages.insert(rng.randrange(len(pages) + 1), "x" * rng.randint(5000, 25000))
+    return pages
+
+
+def stream(pages, state_every=None):
+    splitter = StreamingSplitter()
+    chunks = []
+    for i, page in enumerate(pages):
+        chunks += splitter.feed(page)
+        if state_every and i % state_every == 0:
+            # As when an ingest is resumed from its checkpoint.
+            splitter = StreamingSplitter(state=splitter.state())
+    return chunks + splitter.finish()
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_page_by_page_matches_whole_text(seed):
+    pages = random_pages(random.Random(seed))
+    assert stream(pages) == get_text_chunks("".join(pages))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_resumed_from_state_matches_whole_text(seed):
+    pages = random_pages(random.Random(1000 + seed))
+    assert stream(pages, state_every=3) == get_text_chunks("".join(pages))
+
+
+def test_separator_split_across_pages():
+    pages = ["a" * 6000 + "\n", "\n" + "b" * 6000 + "\n", "\n\n" + "c" * 3000, " " + "d" * 9000]
+    assert stream(pages) == get_text_chunks("".join(pages))